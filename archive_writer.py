@@ -0,0 +1,110 @@
+"""Archive writer."""
+
+import os
+import zipfile
+import zlib
+
+
+class ArchiveWriter():
+    """Write a zip archive and verify it without reading it again.
+
+    The CRC and the size of each member are computed while it is written, then compared with the central directory
+    of the finished archive, whose member count must match the count expected by the caller. The optional structural
+    check also probes the local header of each member.
+    """
+
+    CHUNK_SIZE = 2**20
+    LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+
+    def __init__(self, output_path: str):
+        """Create the archive.
+
+        Args:
+            output_path (str): the archive path
+        """
+        self.output_path = output_path
+        self.archive = zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED)
+        # name: (crc, size) of the members written
+        self.members = {}
+
+    def __enter__(self):
+        """Enter the context.
+
+        Returns:
+            ArchiveWriter: the writer
+        """
+        return self
+
+    def __exit__(self, *args):
+        """Close the archive on exit."""
+        self.close()
+
+    def close(self):
+        """Close the archive, writing its central directory."""
+        self.archive.close()
+
+    def write_dir(self, dir_path: str):
+        """Add the files of a folder, relative to the folder.
+
+        Args:
+            dir_path (str): a folder
+        """
+        for root, dirs, files in os.walk(dir_path):
+            for dir_name in sorted(dirs):
+                path = os.path.join(root, dir_name)
+                self.archive.write(path, os.path.relpath(path, dir_path))
+            for file_name in sorted(files):
+                path = os.path.join(root, file_name)
+                self.write(path, os.path.relpath(path, dir_path))
+
+    def write(self, file_path: str, name: str):
+        """Add a file, computing its CRC while it is written.
+
+        Args:
+            file_path (str): the file
+            name (str): the member name
+        """
+        info = zipfile.ZipInfo.from_file(file_path, name)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        crc = 0
+        size = 0
+        with open(file_path, "rb") as source, self.archive.open(info, "w") as destination:
+            while True:
+                chunk = source.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                destination.write(chunk)
+
+        self.members[info.filename] = (crc, size)
+
+    def verify(self, expected_count: int, structural: bool = True):
+        """Verify the finished archive from its central directory.
+
+        Args:
+            expected_count (int): the number of members the archive must hold, counted from the source
+            structural (bool): also check that each member starts with a local header
+
+        Raises:
+            Exception: the archive does not hold what was written
+        """
+        with zipfile.ZipFile(self.output_path) as archive:
+            infos = [info for info in archive.infolist() if not info.is_dir()]
+
+        if len(infos) != expected_count:
+            raise Exception("Output archive verification failed: {0} members expected, {1} found".format(expected_count, len(infos)))
+
+        for info in infos:
+            if self.members.get(info.filename) != (info.CRC, info.file_size):
+                raise Exception("Output archive verification failed: {0} does not match".format(info.filename))
+
+        if structural:
+            archive_size = os.path.getsize(self.output_path)
+            with open(self.output_path, "rb") as file:
+                for info in infos:
+                    if info.header_offset + info.compress_size > archive_size:
+                        raise Exception("Output archive verification failed: {0} is truncated".format(info.filename))
+                    file.seek(info.header_offset)
+                    if file.read(4) != self.LOCAL_HEADER_SIGNATURE:
+                        raise Exception("Output archive verification failed: {0} has no local header".format(info.filename))
@@ -0,0 +1,58 @@
+"""Startup benchmark.
+
+Measure the time from launching the application to the first drawn window.
+
+Usage:
+    python benchmark_startup.py [--runs 5] [--budget 1.5]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+
+def measure_startup(timeout: float):
+    """Launch the application once and measure the time to the first window.
+
+    Args:
+        timeout (float): maximum time to wait for the window, in seconds
+
+    Returns:
+        float: the time to the first window, in seconds
+    """
+    env = dict(os.environ, BALO_CONVERTER_STARTUP_BENCHMARK="1")
+    start = time.monotonic()
+    process = subprocess.run([sys.executable, "main.py"], cwd=Path(__file__).parent, env=env,
+                             capture_output=True, text=True, timeout=timeout)
+    for line in process.stdout.splitlines():
+        if line.startswith("first-window "):
+            return float(line.split()[1]) - start
+
+    raise RuntimeError("The window was not drawn:\n" + process.stderr)
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description="Measure the time to the first window")
+    parser.add_argument("--runs", type=int, default=5, help="number of launches")
+    parser.add_argument("--budget", type=float, default=None, help="fail if the median time exceeds this budget, in seconds")
+    parser.add_argument("--timeout", type=float, default=30.0, help="maximum time for one launch, in seconds")
+    args = parser.parse_args()
+
+    timings = [measure_startup(args.timeout) for _ in range(args.runs)]
+    median = statistics.median(timings)
+    print("time to first window: min {0:.3f}s, median {1:.3f}s, max {2:.3f}s".format(min(timings), median, max(timings)))
+
+    if args.budget is not None and median > args.budget:
+        print("startup budget exceeded: {0:.3f}s > {1:.3f}s".format(median, args.budget))
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,36 @@
 """converter."""
 
+import io
 import os
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from shutil import copy, make_archive
-from tempfile import TemporaryDirectory
-from typing import Callable
+from shutil import copy, copyfileobj, disk_usage, rmtree
+from tempfile import TemporaryDirectory, gettempdir
+from typing import Callable, List
 import threading
+import time
 import uuid
+import zipfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 from patoolib import extract_archive
 from patoolib.util import PatoolError
 from PIL import Image
+from archive_writer import ArchiveWriter
+from cost_model import CostModel, Progress
+from error_dialog import ErrorDialog
+from governor import Governor
+from metadata_index import MetadataIndex
+from metrics import (ARCHIVES, BYTES_READ, BYTES_WRITTEN, PAGE_DURATION, PAGES, PREFETCH_HITS, QUEUE_DEPTH, STAGE_DURATION,
+                     STREAMING_FALLBACKS, Exporters)
 from preferences import Preferences
+from prefetcher import Prefetcher
+from streaming import StreamingExtractionError, StreamingExtractor
 
 import gi
 
@@ -19,6 +38,44 @@ gi.require_version("Gtk", "3.0")
 from gi.repository import GLib  # noqa: E402
 
 
+# ioctl request to share the blocks of a file on filesystems supporting reflinks (Btrfs, XFS)
+FICLONE = 0x40049409
+
+
+def clone_file(src_path: str, dst_path: str):
+    """Copy a file with a reflink when possible, else with copy_file_range, else with a plain copy.
+
+    Args:
+        src_path (str): the file to copy
+        dst_path (str): the copy
+    """
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return
+            except OSError:
+                pass
+
+        if hasattr(os, "copy_file_range"):
+            size = os.fstat(src.fileno()).st_size
+            copied = 0
+            try:
+                while copied < size:
+                    count = os.copy_file_range(src.fileno(), dst.fileno(), size - copied)
+                    if count == 0:
+                        # some filesystems stop early, the file positions are kept for the plain copy
+                        break
+                    copied += count
+                if copied == size:
+                    return
+            except OSError:
+                if copied:
+                    raise
+
+        copyfileobj(src, dst)
+
+
 def check_cancel_process(func):
     """Check if a cancellation request has been made.
 
@@ -38,60 +95,438 @@ def check_cancel_process(func):
 class Converter():
     """A utility class to extract and convert."""
 
-    def __init__(self, files_to_convert: dict, event: threading.Event, reinit_ui_method: Callable):
+    PROGRESS_INTERVAL = 0.5
+    MIN_QUALITY = 10
+
+    def __init__(self, files_to_convert: dict, event: threading.Event, reinit_ui_method: Callable, progress_method: Callable = None):
         """Initialize the converter class.
 
         Args:
             files_to_convert (dict): a file path and a list [spinner, image_ok, image_error]
             event (threading.Event): an event to signal a request to end processing
             reinit_ui_method (Callable): a method executed at the end of processing
+            progress_method (Callable): a method receiving the progress text during processing
         """
         self.files_to_convert = files_to_convert
         self.event = event
         self.reinit_ui_method = reinit_ui_method
+        self.progress_method = progress_method
+        self.progress = None
+        self.progress_time = 0
 
         self.preferences = Preferences()
+        self.governor = Governor(self.preferences)
 
         self.archive_formats = {
             "cbz": "zip",
             "zip": "zip",
         }
 
+        self.image_formats = {
+            "jpg": "JPEG",
+            "png": "PNG",
+            "webp": "WEBP",
+        }
+
+        # image formats whose size follows the encoder quality
+        self.lossy_image_formats = ("jpg", "webp")
+
+        # how much bigger the converted pages can be than the extracted ones
+        self.image_growth_factors = {
+            "jpg": 1,
+            "png": 3,
+            "webp": 1,
+        }
+
     def run(self):
         """Run the convert."""
-        for file in self.files_to_convert:
-            if self.event.is_set():
-                break
+        try:
+            self.governor.apply_limits()
+            exporter_errors = Exporters.start(self.preferences)
+            if exporter_errors:
+                # the conversion goes on without the metrics
+                GLib.idle_add(self.show_exporter_errors, exporter_errors)
 
-            file["image_ok"].hide()
-            file["image_error"].hide()
-            file["spinner"].start()
-            try:
-                with TemporaryDirectory() as extract_dir_path:
+            cost_model = CostModel(self.preferences)
+            self.files_to_convert, estimates = cost_model.sort(self.files_to_convert)
+            self.progress = Progress(cost_model, estimates)
+
+            prefetch_size = int(self.preferences.get_value("prefetch_size") or self.preferences.DEFAULT_PREFETCH_SIZE)
+            prefetcher = Prefetcher([file["file_path"] for file in self.files_to_convert], prefetch_size * 2**20, self.event)
+        except Exception as err:
+            # the conversion can not start, e.g. the metadata index is locked
+            for file in self.files_to_convert:
+                file["image_error"].show()
+                file["image_error"].set_tooltip_text(str(err))
+            GLib.idle_add(self.reinit_ui_method)
+            return
+
+        prefetcher.start()
+
+        try:
+            for position, file in enumerate(self.files_to_convert):
+                if self.event.is_set():
+                    break
+
+                prefetcher.advance(position)
+                QUEUE_DEPTH.set(len(self.files_to_convert) - position - 1)
+                if prefetcher.is_prefetched(position):
+                    PREFETCH_HITS.inc()
+
+                file["image_ok"].hide()
+                file["image_error"].hide()
+                file["spinner"].start()
+                try:
                     archive_path = Path(file["file_path"])
-                    if archive_path.is_file():
-                        file["spinner"].set_tooltip_text("Extracting the archive")
-                        self.extract_archive(file["file_path"], extract_dir_path)
-                        with TemporaryDirectory() as convert_dir_path:
-                            file["spinner"].set_tooltip_text("Image conversion")
-                            self.convert_image(extract_dir_path, convert_dir_path)
-                            file["spinner"].set_tooltip_text("Creating an archive file")
-                            self.create_archive(file["file_path"], convert_dir_path)
-                            file["image_ok"].show()
-                    else:
+                    if not archive_path.is_file():
                         file["image_error"].show()
                         file["image_error"].set_tooltip_text("Archive file does not exist")
+                    elif self.is_conformant_archive(file["file_path"]):
+                        file["spinner"].set_tooltip_text("Copying the archive")
+                        with STAGE_DURATION.time(stage="copy"):
+                            self.copy_archive(file["file_path"])
+                        file["image_ok"].set_tooltip_text(None)
+                        file["image_ok"].show()
+                        ARCHIVES.inc(result="copied")
+                        BYTES_READ.inc(estimates[position]["size"])
+                    else:
+                        file["image_ok"].set_tooltip_text(self.convert_archive(file))
+                        file["image_ok"].show()
+                        ARCHIVES.inc(result="converted")
+                        BYTES_READ.inc(estimates[position]["size"])
 
-            except PatoolError as err:
-                file["image_error"].show()
-                file["image_error"].set_tooltip_text(err)
+                except PatoolError as err:
+                    file["image_error"].show()
+                    file["image_error"].set_tooltip_text(err)
+                    ARCHIVES.inc(result="failed")
+                except Exception as err:
+                    file["image_error"].show()
+                    file["image_error"].set_tooltip_text(str(err))
+                    ARCHIVES.inc(result="failed")
+
+                file["spinner"].stop()
+                self.progress.finish_archive(estimates[position])
+                self.report_progress(True)
+
+            if not self.event.is_set():
+                # only the time spent converting pages, without the waits and copies of the run
+                cost_model.save_rate(self.progress.convert_seconds, self.progress.converted_megapixels)
+        finally:
+            prefetcher.stop()
+            QUEUE_DEPTH.set(0)
+            GLib.idle_add(self.reinit_ui_method)
+
+    def show_exporter_errors(self, errors: List[str]):
+        """Show the metrics exporters which could not start.
+
+        Args:
+            errors (List[str]): an error per exporter
+        """
+        ErrorDialog("Metrics exporters not started", errors)
+
+    def report_progress(self, force: bool = False):
+        """Send the progress text to the progress method, at most every PROGRESS_INTERVAL seconds.
+
+        Args:
+            force (bool): send the progress text even if it was sent recently
+        """
+        if self.progress_method is None or self.progress is None:
+            return
+
+        now = time.monotonic()
+        if force or now - self.progress_time >= self.PROGRESS_INTERVAL:
+            self.progress_time = now
+            GLib.idle_add(self.progress_method, self.progress.get_text())
+
+    def convert_archive(self, file: dict):
+        """Extract the archive, convert its images and create the output archive.
+
+        Args:
+            file (dict): a file path and its widgets spinner, image_ok and image_error
+
+        Returns:
+            str: how far the output landed from the target size, None without target size
+        """
+        file_path = file["file_path"]
+        if (self.preferences.get_value("streaming_extraction") != "false" and not zipfile.is_zipfile(file_path)
+                and StreamingExtractor.get_tool(file_path) is not None):
+            try:
+                return self.convert_archive_streaming(file)
+            except StreamingExtractionError:
+                # the tool can not read this archive, patool may
+                STREAMING_FALLBACKS.inc()
+
+        scratch_dir_path = self.get_scratch_dir()
+        file["spinner"].set_tooltip_text("Checking the scratch space")
+        with STAGE_DURATION.time(stage="scratch_wait"):
+            self.wait_for_scratch_space(scratch_dir_path, self.estimate_scratch_space(file["file_path"]))
+        with TemporaryDirectory(dir=scratch_dir_path) as extract_dir_path:
+            file["spinner"].set_tooltip_text("Extracting the archive")
+            with STAGE_DURATION.time(stage="extract"):
+                self.extract_archive(file["file_path"], extract_dir_path)
+            # each extracted file is converted or copied into the output archive
+            member_count = self.count_files(extract_dir_path)
+            with TemporaryDirectory(dir=scratch_dir_path) as convert_dir_path:
+                file["spinner"].set_tooltip_text("Image conversion")
+                with STAGE_DURATION.time(stage="convert"):
+                    page_count = self.convert_image(extract_dir_path, convert_dir_path)
+                file["spinner"].set_tooltip_text("Creating an archive file")
+                with STAGE_DURATION.time(stage="archive"):
+                    output_path = self.create_archive(file["file_path"], convert_dir_path, member_count)
+
+        return self.get_target_report(output_path, page_count)
+
+    def convert_archive_streaming(self, file: dict):
+        """Extract the archive in batches while converting them and writing the output archive.
+
+        A thread extracts the next batch while the current one is converted. Each batch is removed once its pages
+        are written to the output archive, so the scratch folder holds about three batches.
+
+        Args:
+            file (dict): a file path and its widgets spinner, image_ok and image_error
+
+        Returns:
+            str: how far the output landed from the target size, None without target size
+        """
+        file_path = file["file_path"]
+        scratch_dir_path = self.get_scratch_dir()
+        batch_size = int(self.preferences.get_value("stream_batch_size") or self.preferences.DEFAULT_STREAM_BATCH_SIZE)
+        extractor = StreamingExtractor(file_path, batch_size, self.event)
+        members = extractor.list_members()
+        # the target page size is computed from the pages of the whole archive, not of a batch
+        image_extensions = tuple(Image.registered_extensions())
+        archive_page_count = len([name for name in members if name.lower().endswith(image_extensions)])
+
+        file["spinner"].set_tooltip_text("Checking the scratch space")
+        with STAGE_DURATION.time(stage="scratch_wait"):
+            self.wait_for_scratch_space(scratch_dir_path, self.estimate_scratch_space(file_path, batch_size, len(members)))
+
+        batches = queue.Queue(maxsize=1)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def extract():
+            try:
+                for batch_dir_path in extractor.batches(scratch_dir_path):
+                    if not put(batch_dir_path):
+                        rmtree(batch_dir_path)
+                        return
+                put(None)
             except Exception as err:
-                file["image_error"].show()
-                file["image_error"].set_tooltip_text(str(err))
+                put(err)
+
+        thread = threading.Thread(target=extract)
+        thread.daemon = True
+
+        path = Path(file_path)
+        output_dir = self.get_output_dir(file_path)
+        # generate a random string to not erase the original file if the output folder is the same folder as the original
+        output_path = str(Path(output_dir, str(uuid.uuid4())))
+        page_count = 0
+
+        file["spinner"].set_tooltip_text("Extracting and converting the archive")
+        with STAGE_DURATION.time(stage="stream"):
+            thread.start()
+            try:
+                with ArchiveWriter(output_path) as writer:
+                    while True:
+                        batch_dir_path = batches.get()
+                        if batch_dir_path is None:
+                            break
+                        if isinstance(batch_dir_path, Exception):
+                            raise batch_dir_path
+                        try:
+                            with TemporaryDirectory(dir=scratch_dir_path) as convert_dir_path:
+                                page_count += self.convert_image(batch_dir_path, convert_dir_path, archive_page_count)
+                                for root, dirs, files in os.walk(convert_dir_path):
+                                    for file_name in sorted(files):
+                                        converted_path = os.path.join(root, file_name)
+                                        writer.write(converted_path, os.path.relpath(converted_path, convert_dir_path))
+                        finally:
+                            rmtree(batch_dir_path)
+                writer.verify(len(members), self.preferences.get_value("verify_output") != "false")
 
-            file["spinner"].stop()
+                final_path = str(Path(output_dir, path.stem)) + "." + self.preferences.get_value("archive_format")
+                os.rename(output_path, final_path)
+                BYTES_WRITTEN.inc(os.path.getsize(final_path))
+            except Exception:
+                stop.set()
+                thread.join()
+                while not batches.empty():
+                    batch_dir_path = batches.get()
+                    if isinstance(batch_dir_path, str):
+                        rmtree(batch_dir_path)
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+                raise
 
-        GLib.idle_add(self.reinit_ui_method)
+        return self.get_target_report(final_path, page_count)
+
+    def is_conformant_archive(self, file_path: str):
+        """Check from the member headers alone if an archive is already in the output format.
+
+        The archive is conformant when it is a zip with the output archive type and all its images already have
+        the output image format and fit in the output image size.
+
+        Args:
+            file_path (str): file path
+
+        Returns:
+            bool: return true if the conversion would not change any page
+        """
+        input_archive_format = self.archive_formats.get(Path(file_path).suffix[1:].lower())
+        output_archive_format = self.archive_formats[self.preferences.get_value("archive_format")]
+        if input_archive_format != output_archive_format or not zipfile.is_zipfile(file_path):
+            return False
+
+        image_format, max_size = self.get_image_settings()
+        target_size_mode = self.preferences.get_value("target_size_mode")
+        if target_size_mode == self.preferences.TARGET_ARCHIVE_SIZE and os.path.getsize(file_path) > self.get_target_size():
+            return False
+
+        with zipfile.ZipFile(file_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                try:
+                    # only the image header is read
+                    with archive.open(info) as member, Image.open(member) as image:
+                        image_size = image.size
+                        pil_format = image.format
+                except Exception:
+                    # It's not a picture, it would be copied as is
+                    continue
+
+                if os.path.splitext(info.filename)[1] != "." + image_format or pil_format != self.image_formats[image_format]:
+                    return False
+                if max_size is not None and (image_size[0] > max_size[0] or image_size[1] > max_size[1]):
+                    return False
+                if target_size_mode == self.preferences.TARGET_PAGE_SIZE and info.file_size > self.get_target_size():
+                    return False
+
+        return True
+
+    @ check_cancel_process
+    def copy_archive(self, file_path: str):
+        """Copy an archive already in the output format to the output folder.
+
+        Args:
+            file_path (str): the file path being converted
+        """
+        path = Path(file_path)
+        output_dir = self.get_output_dir(file_path)
+        rename_output_archive_format = self.preferences.get_value("archive_format")
+        final_path = Path(output_dir, path.stem + "." + rename_output_archive_format)
+
+        if final_path.exists() and final_path.samefile(path):
+            return
+
+        # copy to a random name first so a failed copy never leaves a partial output
+        output_path = str(Path(output_dir, str(uuid.uuid4())))
+        try:
+            clone_file(file_path, output_path)
+            if os.path.getsize(output_path) != os.path.getsize(file_path):
+                raise Exception("Output archive verification failed: the copy is truncated")
+            os.rename(output_path, final_path)
+            BYTES_WRITTEN.inc(os.path.getsize(final_path))
+        except Exception:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            raise
+
+    def get_output_dir(self, file_path: str):
+        """Get the folder where the output archive is written.
+
+        Args:
+            file_path (str): the file path being converted
+
+        Returns:
+            str: a directory path
+        """
+        output_folder = self.preferences.get_value("output_folder")
+        if output_folder == self.preferences.OUTPUT_SELECTED_FOLDER:
+            return self.preferences.get_value("selected_folder")
+
+        return str(Path(file_path).parent)
+
+    def get_scratch_dir(self):
+        """Get the directory where the archives are extracted and converted.
+
+        Returns:
+            str: a directory path, or None for the system temporary directory
+        """
+        return self.preferences.get_scratch_dir()
+
+    def estimate_scratch_space(self, file_path: str, batch_size: int = None, member_count: int = None):
+        """Estimate the scratch space needed to convert an archive.
+
+        The uncompressed size is read from the metadata index or the zip central directory, other formats fall back
+        to the archive size since their pages are already compressed images.
+
+        Args:
+            file_path (str): file path
+            batch_size (int): the number of members extracted at once by the streaming extraction, None for all
+            member_count (int): the number of members of the archive, None to read it from the metadata index
+
+        Returns:
+            int: the number of bytes needed for the extracted and the converted pages
+        """
+        index = MetadataIndex()
+        try:
+            metadata = index.get(file_path)
+        finally:
+            index.close()
+
+        if metadata is not None:
+            uncompressed_size = metadata["uncompressed_size"]
+        elif zipfile.is_zipfile(file_path):
+            with zipfile.ZipFile(file_path) as archive:
+                uncompressed_size = sum(info.file_size for info in archive.infolist())
+        else:
+            uncompressed_size = os.path.getsize(file_path)
+
+        if member_count is None and metadata is not None:
+            member_count = len(metadata["members"])
+        if batch_size is not None and member_count:
+            # about three batches are on the scratch folder at once
+            uncompressed_size = uncompressed_size * min(1, 3 * batch_size / member_count)
+
+        growth_factor = self.image_growth_factors.get(self.preferences.get_value("image_format"), 1)
+        return uncompressed_size + uncompressed_size * growth_factor
+
+    @ check_cancel_process
+    def wait_for_scratch_space(self, scratch_dir_path: str, required_size: int):
+        """Wait until the scratch directory has enough free space, or fail.
+
+        Args:
+            scratch_dir_path (str): a directory path, or None for the system temporary directory
+            required_size (int): the number of bytes needed
+
+        Raises:
+            Exception: not enough free space before the waiting time set in the preferences
+        """
+        if scratch_dir_path is None:
+            scratch_dir_path = gettempdir()
+        scratch_wait = int(self.preferences.get_value("scratch_wait") or self.preferences.DEFAULT_SCRATCH_WAIT)
+        deadline = time.monotonic() + scratch_wait
+
+        while True:
+            free_size = disk_usage(scratch_dir_path).free
+            if free_size >= required_size:
+                return
+            if time.monotonic() >= deadline:
+                raise Exception("Not enough scratch space in {0}: {1} MB needed, {2} MB free".format(
+                    scratch_dir_path, required_size // 2**20, free_size // 2**20))
+            if self.event.wait(1):
+                raise Exception("Conversion stopped by user")
 
     @ check_cancel_process
     def extract_archive(self, file_path: str, extract_dir_path: str):
@@ -104,50 +539,214 @@ class Converter():
         extract_archive(file_path, outdir=extract_dir_path, verbosity=-1, interactive=False)
 
     @ check_cancel_process
-    def convert_image(self, extract_dir_path: str, convert_dir_path: str):
+    def convert_image(self, extract_dir_path: str, convert_dir_path: str, archive_page_count: int = None):
         """Convert an image file.
 
         Args:
             extract_dir_path (str): a directory path where the images are located
             convert_dir_path (str): a directory path where the images will be converted
+            archive_page_count (int): the number of pages of the whole archive, None if they are all in extract_dir_path
+
+        Returns:
+            int: the number of images converted
         """
+        page_count = 0
         extract_path = Path(extract_dir_path)
         convert_path = Path(extract_dir_path)
         if extract_path.is_dir() and convert_path.is_dir():
+            pages = []
             for root, dirs, files in os.walk(extract_path):
                 root_dst = root.replace(extract_dir_path, convert_dir_path)
                 for dir_name in dirs:
                     os.mkdir(Path(root_dst, dir_name))
                 for file_name in files:
-                    try:
-                        image = Image.open(Path(root, file_name))
-                        image.convert("RGB")
+                    pages.append((Path(root, file_name), Path(root_dst, file_name)))
+
+            # the preferences are read once, not from every worker
+            image_format, max_size = self.get_image_settings()
+            if archive_page_count is None:
+                image_extensions = tuple(Image.registered_extensions())
+                archive_page_count = len([page for page in pages if page[0].name.lower().endswith(image_extensions)])
+            max_bytes = self.get_target_page_bytes(archive_page_count)
+
+            # the workers inherit the limits applied once to this thread, without an ionice process per worker
+            executor = ThreadPoolExecutor(max_workers=self.governor.get_worker_count())
+            start = time.monotonic()
+            try:
+                futures = {executor.submit(self.convert_page, source_path, destination_path, image_format, max_size, max_bytes): source_path
+                           for source_path, destination_path in pages}
+                for future in as_completed(futures):
+                    if self.event.is_set():
+                        for remaining_future in futures:
+                            remaining_future.cancel()
+                        raise Exception("Conversion stopped by user")
+
+                    image_size = future.result()
+                    if image_size is not None:
+                        page_count += 1
+                        PAGES.inc()
+                    if image_size is not None and self.progress is not None:
+                        self.progress.add_page(*image_size, os.path.getsize(futures[future]))
+                        self.report_progress()
+            finally:
+                executor.shutdown()
+                if self.progress is not None:
+                    self.progress.add_convert_time(time.monotonic() - start)
+
+        return page_count
+
+    def convert_page(self, source_path: Path, destination_path: Path, image_format: str, max_size: tuple, max_bytes: int = None):
+        """Convert one image file, or copy it if it is not a picture.
+
+        Args:
+            source_path (Path): the extracted file
+            destination_path (Path): the converted file, its extension is replaced by the image format
+            image_format (str): the output image format
+            max_size (tuple): the maximum width and height, None for the original size
+            max_bytes (int): the size budget of the page, None for the best quality
+
+        Returns:
+            tuple: the size of the source image, None if the file was copied
+        """
+        try:
+            image = Image.open(source_path)
+            image_size = image.size
+            with self.governor.reserve_memory(*image_size), PAGE_DURATION.time():
+                self.encode_image(image, os.path.splitext(destination_path)[0]+"." + image_format, image_format, max_size, max_bytes)
+            return image_size
+        except Exception:
+            # It's not a picture
+            copy(source_path, destination_path)
+            return None
+
+    def encode_image(self, image: Image.Image, output, image_format: str, max_size: tuple, max_bytes: int = None):
+        """Resize and encode an image with the output settings.
 
-                        if self.preferences.get_value("image_size") == self.preferences.OUTPUT_CUSTOM_IMAGE_SIZE:
-                            image.thumbnail((int(self.preferences.get_value("image_width")), int(self.preferences.get_value("image_height"))))
+        With a size budget, the highest quality fitting in the budget is searched by encoding the decoded image in
+        memory, down to MIN_QUALITY. Lossless formats ignore the budget.
 
-                        image.save(os.path.splitext(Path(root_dst, file_name))[0]+"." +
-                                   self.preferences.get_value("image_format"), optimize=True, quality=100)
-                    except Exception:
-                        # It's not a picture
-                        copy(Path(root, file_name), Path(root_dst, file_name))
+        Args:
+            image (Image.Image): the source image
+            output (Union[str, BinaryIO]): a file path or a file object
+            image_format (str): the output image format
+            max_size (tuple): the maximum width and height, None for the original size
+            max_bytes (int): the size budget of the image, None for the best quality
+        """
+        if image_format in self.lossy_image_formats and image.mode not in ("RGB", "L"):
+            # JPEG has no alpha nor palette, such pages would be copied as is, out of the size budget
+            image = image.convert("RGB")
+
+        if max_size is not None:
+            image.thumbnail(max_size)
+
+        if max_bytes is None or image_format not in self.lossy_image_formats:
+            image.save(output, format=self.image_formats[image_format], optimize=True, quality=100)
+            return
+
+        low = self.MIN_QUALITY
+        high = 100
+        best = None
+        while low <= high:
+            quality = (low + high) // 2
+            buffer = io.BytesIO()
+            image.save(buffer, format=self.image_formats[image_format], optimize=True, quality=quality)
+            if buffer.tell() <= max_bytes:
+                best = buffer
+                low = quality + 1
+            else:
+                high = quality - 1
+
+        if best is None:
+            # the budget can not be reached, the lowest quality is the closest
+            best = io.BytesIO()
+            image.save(best, format=self.image_formats[image_format], optimize=True, quality=self.MIN_QUALITY)
+
+        if isinstance(output, (str, Path)):
+            with open(output, "wb") as file:
+                file.write(best.getvalue())
+        else:
+            output.write(best.getvalue())
+
+    def get_target_size(self):
+        """Get the target size set in the preferences.
+
+        Returns:
+            int: a number of bytes
+        """
+        return int(self.preferences.get_value("target_size") or self.preferences.DEFAULT_TARGET_SIZE) * 1024
+
+    def get_target_page_bytes(self, page_count: int):
+        """Get the size budget of a page.
+
+        Args:
+            page_count (int): the number of pages of the archive
+
+        Returns:
+            int: a number of bytes, None without target size
+        """
+        target_size_mode = self.preferences.get_value("target_size_mode")
+        if target_size_mode == self.preferences.TARGET_PAGE_SIZE:
+            return self.get_target_size()
+        if target_size_mode == self.preferences.TARGET_ARCHIVE_SIZE and page_count:
+            return self.get_target_size() // page_count
+
+        return None
+
+    def get_target_report(self, output_path: str, page_count: int):
+        """Compare the output archive with the target size.
+
+        Args:
+            output_path (str): the output archive
+            page_count (int): the number of pages converted
+
+        Returns:
+            str: the output size, the target size and the difference, None without target size
+        """
+        target_size_mode = self.preferences.get_value("target_size_mode")
+        if output_path is None or target_size_mode not in (self.preferences.TARGET_ARCHIVE_SIZE, self.preferences.TARGET_PAGE_SIZE):
+            return None
+
+        size = os.path.getsize(output_path)
+        unit = ""
+        if target_size_mode == self.preferences.TARGET_PAGE_SIZE:
+            size = size / max(page_count, 1)
+            unit = " per page"
+
+        target_size = self.get_target_size()
+        if target_size <= 0:
+            return "Output {0:.0f} KB{1}".format(size / 1024, unit)
+        return "Output {0:.0f} KB{1}, target {2:.0f} KB ({3:+.1f}%)".format(
+            size / 1024, unit, target_size / 1024, 100 * (size - target_size) / target_size)
+
+    def get_image_settings(self):
+        """Get the output image settings.
+
+        Returns:
+            tuple: the output image format, and the maximum width and height or None for the original size
+        """
+        image_format = self.preferences.get_value("image_format")
+        max_size = None
+        if self.preferences.get_value("image_size") == self.preferences.OUTPUT_CUSTOM_IMAGE_SIZE:
+            max_size = (int(self.preferences.get_value("image_width")), int(self.preferences.get_value("image_height")))
+
+        return image_format, max_size
 
     @ check_cancel_process
-    def create_archive(self, file_path: str, dir_path: str):
+    def create_archive(self, file_path: str, dir_path: str, member_count: int):
         """Create an archive file.
 
         Args:
             file_path (str): the file path being converted
             dir_path (str): a directory path where the converted images are located
+            member_count (int): the number of files extracted from the archive
+
+        Returns:
+            str: the output archive path
         """
         path = Path(file_path)
         file_name = path.stem
 
-        output_folder = self.preferences.get_value("output_folder")
-        if output_folder == self.preferences.OUTPUT_SELECTED_FOLDER:
-            output_dir = self.preferences.get_value("selected_folder")
-        else:
-            output_dir = str(path.parent)
+        output_dir = self.get_output_dir(file_path)
 
         # rename format cbz, cbr
         rename_output_archive_format = self.preferences.get_value("archive_format")
@@ -156,7 +755,40 @@ class Converter():
         if output_dir is not None:
             # generate a random string to not erase the original file if the output folder is the same folder as the original
             file_name_tmp = str(uuid.uuid4())
-            output_path = str(Path(output_dir, file_name_tmp))
-            make_archive(output_path, output_archive_format, dir_path)
-            # rename file name and file format
-            os.rename(output_path + "." + output_archive_format, str(Path(output_dir, file_name)) + "." + rename_output_archive_format)
+            output_path = str(Path(output_dir, file_name_tmp)) + "." + output_archive_format
+            try:
+                self.write_archive(dir_path, output_path, member_count)
+                # rename file name and file format
+                final_path = str(Path(output_dir, file_name)) + "." + rename_output_archive_format
+                os.rename(output_path, final_path)
+            except Exception:
+                # a failed archive never replaces an existing one
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+                raise
+            BYTES_WRITTEN.inc(os.path.getsize(final_path))
+            return final_path
+
+    def write_archive(self, dir_path: str, output_path: str, member_count: int):
+        """Write a zip archive of a folder and verify it.
+
+        Args:
+            dir_path (str): a directory path where the converted images are located
+            output_path (str): the archive path
+            member_count (int): the number of files extracted from the archive, which the output must hold
+        """
+        with ArchiveWriter(output_path) as writer:
+            writer.write_dir(dir_path)
+        writer.verify(member_count, self.preferences.get_value("verify_output") != "false")
+
+    @staticmethod
+    def count_files(dir_path: str):
+        """Count the files of a folder and its subfolders.
+
+        Args:
+            dir_path (str): a directory path
+
+        Returns:
+            int: the number of files
+        """
+        return sum(len(files) for root, dirs, files in os.walk(dir_path))
@@ -0,0 +1,208 @@
+"""Cost model."""
+
+import time
+import zipfile
+from pathlib import Path
+from typing import List
+
+from PIL import Image
+from metadata_index import MetadataIndex
+from preferences import Preferences
+
+
+class CostModel():
+    """Estimate the conversion time of archives.
+
+    The cost of an archive is its number of megapixels, estimated from the dimensions of its first image and its
+    number of images. The time per megapixel is measured on every run and saved in the preferences.
+    """
+
+    DEFAULT_MEGAPIXEL_RATE = 0.05
+    # compressed bytes per megapixel, for the archives that can not be inspected
+    DEFAULT_BYTES_PER_MEGAPIXEL = 250000
+    # weight of the saved rate against the current measure, in megapixels
+    PRIOR_MEGAPIXELS = 50
+
+    def __init__(self, preferences: Preferences):
+        """Initialize the cost model.
+
+        Args:
+            preferences (Preferences): the preferences where the measured rate is saved
+        """
+        self.preferences = preferences
+        try:
+            self.megapixel_rate = float(self.preferences.get_value("megapixel_rate"))
+        except (TypeError, ValueError):
+            self.megapixel_rate = self.DEFAULT_MEGAPIXEL_RATE
+
+    def estimate(self, file_path: str, index: MetadataIndex = None):
+        """Estimate the cost of an archive.
+
+        Args:
+            file_path (str): file path
+            index (MetadataIndex): the metadata index, read before the archive
+
+        Returns:
+            dict: the archive size in bytes, its number of pages and megapixels and the estimated time in seconds
+        """
+        try:
+            size = Path(file_path).stat().st_size
+        except OSError:
+            size = 0
+
+        pages = 0
+        megapixels = 0
+        metadata = index.get(file_path) if index is not None else None
+        try:
+            if metadata is not None:
+                pages = metadata["pages"]
+                megapixels = pages * metadata["width"] * metadata["height"] / 10**6
+            elif zipfile.is_zipfile(file_path):
+                pages, megapixels = self.inspect_zip(file_path)
+        except Exception:
+            pass
+
+        if not megapixels:
+            megapixels = size / self.DEFAULT_BYTES_PER_MEGAPIXEL
+
+        return {"size": size, "pages": pages, "megapixels": megapixels, "seconds": megapixels * self.megapixel_rate}
+
+    def inspect_zip(self, file_path: str):
+        """Count the pages and the megapixels of a zip archive from its central directory and first image.
+
+        Args:
+            file_path (str): file path
+
+        Returns:
+            tuple: the number of pages and of megapixels
+        """
+        with zipfile.ZipFile(file_path) as archive:
+            infos = [info for info in archive.infolist() if not info.is_dir()]
+            for info in infos:
+                try:
+                    with archive.open(info) as member, Image.open(member) as image:
+                        width, height = image.size
+                except Exception:
+                    # It's not a picture
+                    continue
+                pages = len([info for info in infos if info.filename.lower().endswith(tuple(Image.registered_extensions()))])
+                return pages, pages * width * height / 10**6
+
+        return 0, 0
+
+    def sort(self, files_to_convert: List[dict]):
+        """Sort the files to convert, the most expensive first.
+
+        Args:
+            files_to_convert (List[dict]): files with their widgets
+
+        Returns:
+            tuple: the sorted files and their estimates, in the same order
+        """
+        index = MetadataIndex()
+        try:
+            estimates = [self.estimate(file["file_path"], index) for file in files_to_convert]
+        finally:
+            index.close()
+        order = sorted(range(len(files_to_convert)), key=lambda i: estimates[i]["seconds"], reverse=True)
+        return [files_to_convert[i] for i in order], [estimates[i] for i in order]
+
+    def save_rate(self, seconds: float, megapixels: float):
+        """Save the time per megapixel measured during a run.
+
+        The measure is weighted by its number of megapixels against the saved rate, so a short run barely moves it.
+
+        Args:
+            seconds (float): the time spent converting the pages
+            megapixels (float): the number of megapixels converted
+        """
+        if megapixels <= 0:
+            return
+
+        self.megapixel_rate = (self.megapixel_rate * self.PRIOR_MEGAPIXELS + seconds) / (self.PRIOR_MEGAPIXELS + megapixels)
+        self.preferences.set_value("megapixel_rate", str(self.megapixel_rate))
+
+
+class Progress():
+    """Follow the progress of a run and estimate the remaining time."""
+
+    def __init__(self, cost_model: CostModel, estimates: List[dict]):
+        """Initialize the progress.
+
+        Args:
+            cost_model (CostModel): the cost model which produced the estimates
+            estimates (List[dict]): the estimates of the queued archives
+        """
+        self.cost_model = cost_model
+        self.total_megapixels = sum(estimate["megapixels"] for estimate in estimates)
+        self.start_time = time.monotonic()
+
+        self.pages = 0
+        # bytes of the finished archives, and of the pages read in the current archive
+        self.archives_bytes = 0
+        self.current_bytes = 0
+        # megapixels of the finished archives, and of the pages converted in the current archive
+        self.archives_megapixels = 0
+        self.current_megapixels = 0
+        # megapixels actually converted and the time spent converting them, to measure the rate
+        self.converted_megapixels = 0
+        self.convert_seconds = 0
+
+    def add_page(self, width: int, height: int, size: int):
+        """Count a converted page.
+
+        Args:
+            width (int): the width of the source image
+            height (int): the height of the source image
+            size (int): the size of the source image, in bytes
+        """
+        self.pages += 1
+        self.current_bytes += size
+        self.current_megapixels += width * height / 10**6
+        self.converted_megapixels += width * height / 10**6
+
+    def add_convert_time(self, seconds: float):
+        """Count the time spent converting the pages of an archive or a batch.
+
+        Args:
+            seconds (float): a number of seconds
+        """
+        self.convert_seconds += seconds
+
+    def finish_archive(self, estimate: dict):
+        """Count a finished archive.
+
+        Args:
+            estimate (dict): the estimate of the archive
+        """
+        self.archives_megapixels += estimate["megapixels"]
+        self.current_megapixels = 0
+        self.archives_bytes += estimate["size"]
+        self.current_bytes = 0
+
+    def get_elapsed_time(self):
+        """Get the time since the start of the run.
+
+        Returns:
+            float: a number of seconds
+        """
+        return time.monotonic() - self.start_time
+
+    def get_text(self):
+        """Get the progress of the run, to be shown in the status bar.
+
+        Returns:
+            str: the percent complete, the throughput and the estimated remaining time
+        """
+        elapsed_time = max(self.get_elapsed_time(), 10**-6)
+        done_megapixels = self.archives_megapixels + self.current_megapixels
+        done_bytes = self.archives_bytes + self.current_bytes
+        percent = min(100 * done_megapixels / self.total_megapixels, 100) if self.total_megapixels else 0
+
+        # the saved rate counts as a first measure, the current run refines it
+        prior = self.cost_model.PRIOR_MEGAPIXELS
+        rate = (self.cost_model.megapixel_rate * prior + elapsed_time) / (prior + self.converted_megapixels)
+        remaining_time = int(max(self.total_megapixels - done_megapixels, 0) * rate)
+
+        return "Converting... {0:.0f}% - {1:.1f} pages/s - {2:.1f} MB/s - ETA {3} min {4:02d} s".format(
+            percent, self.pages / elapsed_time, done_bytes / 2**20 / elapsed_time, remaining_time // 60, remaining_time % 60)
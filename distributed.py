@@ -0,0 +1,426 @@
+"""Distributed conversion.
+
+A coordinator shards the queued archives between workers, which run the extract/convert/archive pipeline and stream
+the output archives back. Every message is a 4 bytes length, a JSON header and, when the header has a size, a binary
+payload of that size.
+
+Usage:
+    python distributed.py coordinator [--host HOST] [--port PORT] ARCHIVE...
+    python distributed.py worker [--host HOST] [--port PORT]
+"""
+
+import argparse
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import uuid
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import List
+
+from converter import Converter
+from metrics import Exporters
+from preferences import Preferences
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 7481
+# a worker which sends nothing during this time is lost, and its job is given to another worker
+LEASE_TIME = 30
+HEARTBEAT_INTERVAL = 10
+MAX_ATTEMPTS = 3
+CHUNK_SIZE = 2**20
+# the preferences sent with each job
+JOB_SETTINGS = ("archive_format", "image_format", "image_size", "image_width", "image_height", "target_size_mode", "target_size")
+
+
+def send_message(sock: socket.socket, header: dict, file_path: str = None):
+    """Send a message.
+
+    Args:
+        sock (socket.socket): a connected socket
+        header (dict): the message header
+        file_path (str): a file sent as the payload
+    """
+    if file_path is not None:
+        header = dict(header, size=os.path.getsize(file_path))
+    data = json.dumps(header).encode()
+    sock.sendall(struct.pack("!I", len(data)) + data)
+    if file_path is not None:
+        with open(file_path, "rb") as file:
+            sock.sendfile(file)
+
+
+def receive_exactly(sock: socket.socket, size: int):
+    """Receive a number of bytes.
+
+    Args:
+        sock (socket.socket): a connected socket
+        size (int): the number of bytes
+
+    Raises:
+        ConnectionError: the connection was closed
+
+    Returns:
+        bytes: the bytes received
+    """
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(min(size - len(data), CHUNK_SIZE))
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        data += chunk
+
+    return bytes(data)
+
+
+def receive_message(sock: socket.socket):
+    """Receive a message header.
+
+    Args:
+        sock (socket.socket): a connected socket
+
+    Returns:
+        dict: the message header, its payload must be read with receive_payload
+    """
+    size, = struct.unpack("!I", receive_exactly(sock, 4))
+    return json.loads(receive_exactly(sock, size))
+
+
+class WriteError(Exception):
+    """A received file could not be written locally, the connection is still usable."""
+
+
+def receive_payload(sock: socket.socket, size: int, file_path: str):
+    """Receive a payload into a file, chunk by chunk.
+
+    The whole payload is received even if the file can not be written, so the next message can be read.
+
+    Args:
+        sock (socket.socket): a connected socket
+        size (int): the payload size
+        file_path (str): the file written
+
+    Raises:
+        WriteError: the file could not be written
+    """
+    error = None
+    try:
+        file = open(file_path, "wb")
+    except OSError as err:
+        file, error = None, err
+    try:
+        while size > 0:
+            chunk = receive_exactly(sock, min(size, CHUNK_SIZE))
+            size -= len(chunk)
+            if error is None:
+                try:
+                    file.write(chunk)
+                except OSError as err:
+                    error = err
+    finally:
+        if file is not None:
+            try:
+                file.close()
+            except OSError as err:
+                error = error or err
+    if error is not None:
+        raise WriteError("Can not write {0}: {1}".format(file_path, error))
+
+
+class JobPreferences(Preferences):
+    """The preferences of the coordinator, sent with a job.
+
+    Args:
+        Preferences (Preferences): the local preferences, used for the settings which are not sent
+    """
+
+    def __init__(self, settings: dict):
+        """Initialize the job preferences.
+
+        Args:
+            settings (dict): the settings sent by the coordinator
+        """
+        super().__init__()
+        self.settings = settings
+
+    def get_value(self, key: str):
+        """Get the value for a key, from the job settings first.
+
+        Args:
+            key (str): a key
+        """
+        if key in self.settings:
+            return self.settings[key]
+
+        return super().get_value(key)
+
+
+class Coordinator():
+    """Shard the archives between the workers and write the output archives."""
+
+    def __init__(self, files_path: List[str], host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+        """Initialize the coordinator.
+
+        Args:
+            files_path (List[str]): the archives to convert
+            host (str): the address to listen on
+            port (int): the port to listen on
+        """
+        self.host = host
+        self.port = port
+
+        self.preferences = Preferences()
+        self.converter = Converter([], threading.Event(), lambda: None)
+        self.settings = {key: self.preferences.get_value(key) for key in JOB_SETTINGS}
+
+        self.queue = [{"id": index, "file_path": file_path, "attempts": 0} for index, file_path in enumerate(files_path)]
+        self.unfinished = len(self.queue)
+        self.failures = []
+        self.condition = threading.Condition()
+
+    def run(self):
+        """Accept workers until every archive is converted or has failed.
+
+        Returns:
+            List[str]: the errors
+        """
+        with socket.create_server((self.host, self.port)) as server:
+            server.settimeout(1)
+            print("Coordinator listening on {0}:{1}".format(self.host, self.port), flush=True)
+            while self.unfinished > 0:
+                try:
+                    sock, address = server.accept()
+                except socket.timeout:
+                    continue
+                thread = threading.Thread(target=self.serve_worker, args=(sock, address))
+                thread.daemon = True
+                thread.start()
+
+        return self.failures
+
+    def take_job(self):
+        """Take the next job, waiting for the jobs of lost workers.
+
+        Returns:
+            dict: a job, or None when everything is done
+        """
+        with self.condition:
+            while not self.queue and self.unfinished > 0:
+                self.condition.wait()
+            if not self.queue:
+                return None
+            return self.queue.pop(0)
+
+    def finish_job(self, job: dict, error: str = None, retry: bool = True):
+        """Mark a job finished, or retry it.
+
+        Args:
+            job (dict): a job
+            error (str): the error, None if the job succeeded
+            retry (bool): give the failed job to a worker again, up to MAX_ATTEMPTS
+        """
+        with self.condition:
+            if error is not None:
+                job["attempts"] += 1
+                if retry and job["attempts"] < MAX_ATTEMPTS:
+                    self.queue.append(job)
+                    self.condition.notify_all()
+                    return
+                self.failures.append(job["file_path"] + " : " + error)
+                print("Failed {0}: {1}".format(job["file_path"], error), flush=True)
+            else:
+                print("Converted " + job["file_path"], flush=True)
+            self.unfinished -= 1
+            self.condition.notify_all()
+
+    def serve_worker(self, sock: socket.socket, address: tuple):
+        """Send jobs to a worker until there are no more or the worker is lost.
+
+        Args:
+            sock (socket.socket): the worker connection
+            address (tuple): the worker address
+        """
+        with sock:
+            sock.settimeout(LEASE_TIME)
+            job = None
+            try:
+                receive_message(sock)
+                while True:
+                    job = self.take_job()
+                    if job is None:
+                        send_message(sock, {"type": "done"})
+                        return
+                    if not Path(job["file_path"]).is_file():
+                        self.finish_job(job, "Archive file does not exist")
+                        job = None
+                        continue
+
+                    send_message(sock, {"type": "job", "id": job["id"], "name": Path(job["file_path"]).name,
+                                        "settings": self.settings}, job["file_path"])
+                    try:
+                        error = self.receive_result(sock, job)
+                    except WriteError as err:
+                        # the output can not be written here, another worker would not do better
+                        self.finish_job(job, str(err), False)
+                    else:
+                        self.finish_job(job, error)
+                    job = None
+            except (OSError, ValueError) as err:
+                # the worker is lost, its lease is given back
+                print("Worker {0} lost: {1}".format(address[0], err), flush=True)
+                if job is not None:
+                    self.finish_job(job, "Worker lost")
+
+    def receive_result(self, sock: socket.socket, job: dict):
+        """Wait for the result of a job, renewing the lease on each heartbeat.
+
+        Args:
+            sock (socket.socket): the worker connection
+            job (dict): the job sent
+
+        Raises:
+            WriteError: the output archive could not be written
+
+        Returns:
+            str: the error of the worker, None if the output archive was written
+        """
+        while True:
+            header = receive_message(sock)
+            if header["type"] == "heartbeat":
+                continue
+            if header["type"] == "error":
+                return header["message"]
+
+            path = Path(job["file_path"])
+            output_dir = self.converter.get_output_dir(job["file_path"])
+            # write to a random name to not erase the original file if the output folder is the same folder
+            output_path = str(Path(output_dir, str(uuid.uuid4())))
+            try:
+                receive_payload(sock, header["size"], output_path)
+                try:
+                    os.rename(output_path, str(Path(output_dir, path.stem)) + "." + self.settings["archive_format"])
+                except OSError as err:
+                    raise WriteError("Can not rename {0}: {1}".format(output_path, err))
+            finally:
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+            return None
+
+
+class Worker():
+    """Run the conversion pipeline on the jobs sent by a coordinator."""
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+        """Initialize the worker.
+
+        Args:
+            host (str): the coordinator address
+            port (int): the coordinator port
+        """
+        self.host = host
+        self.port = port
+        self.lock = threading.Lock()
+        self.busy = threading.Event()
+
+    def send(self, sock: socket.socket, header: dict, file_path: str = None):
+        """Send a message, one at a time with the heartbeats.
+
+        Args:
+            sock (socket.socket): the coordinator connection
+            header (dict): the message header
+            file_path (str): a file sent as the payload
+        """
+        with self.lock:
+            send_message(sock, header, file_path)
+
+    def send_heartbeats(self, sock: socket.socket, stop: threading.Event):
+        """Renew the lease of the current job.
+
+        Args:
+            sock (socket.socket): the coordinator connection
+            stop (threading.Event): an event to stop the heartbeats
+        """
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            if self.busy.is_set():
+                try:
+                    self.send(sock, {"type": "heartbeat"})
+                except OSError:
+                    return
+
+    def run(self):
+        """Convert jobs until the coordinator has no more."""
+        for error in Exporters.start(Preferences()):
+            print("Metrics not started: " + error, flush=True)
+        with socket.create_connection((self.host, self.port)) as sock:
+            stop = threading.Event()
+            heartbeat = threading.Thread(target=self.send_heartbeats, args=(sock, stop))
+            heartbeat.daemon = True
+            heartbeat.start()
+            try:
+                self.send(sock, {"type": "hello", "host": socket.gethostname()})
+                while True:
+                    header = receive_message(sock)
+                    if header["type"] == "done":
+                        return
+                    self.busy.set()
+                    try:
+                        self.run_job(sock, header)
+                    finally:
+                        self.busy.clear()
+            finally:
+                stop.set()
+
+    def run_job(self, sock: socket.socket, header: dict):
+        """Receive an archive, convert it and send the output archive.
+
+        Args:
+            sock (socket.socket): the coordinator connection
+            header (dict): the job header
+        """
+        converter = Converter([], threading.Event(), lambda: None)
+        converter.preferences = JobPreferences(header["settings"])
+        converter.governor.apply_limits()
+        with TemporaryDirectory(dir=converter.get_scratch_dir()) as job_dir_path:
+            file_path = str(Path(job_dir_path, Path(header["name"]).name))
+            try:
+                receive_payload(sock, header["size"], file_path)
+                if converter.is_conformant_archive(file_path):
+                    output_path = file_path
+                else:
+                    extract_dir_path = str(Path(job_dir_path, "extract"))
+                    convert_dir_path = str(Path(job_dir_path, "convert"))
+                    os.mkdir(extract_dir_path)
+                    os.mkdir(convert_dir_path)
+                    converter.extract_archive(file_path, extract_dir_path)
+                    converter.convert_image(extract_dir_path, convert_dir_path)
+                    output_path = str(Path(job_dir_path, "output.zip"))
+                    converter.write_archive(convert_dir_path, output_path, converter.count_files(extract_dir_path))
+            except Exception as err:
+                self.send(sock, {"type": "error", "id": header["id"], "message": str(err)})
+            else:
+                self.send(sock, {"type": "result", "id": header["id"]}, output_path)
+
+
+def main():
+    """Run a coordinator or a worker."""
+    parser = argparse.ArgumentParser(description="Distributed conversion")
+    parser.add_argument("role", choices=["coordinator", "worker"])
+    parser.add_argument("files_path", nargs="*", metavar="archive", help="archives to convert (coordinator)")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="address to listen on, or of the coordinator")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    # options may come before or after the archives
+    args = parser.parse_intermixed_args()
+
+    if args.role == "coordinator":
+        failures = Coordinator(args.files_path, args.host, args.port).run()
+        return 1 if failures else 0
+
+    Worker(args.host, args.port).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,17 @@
 """Drop area."""
 
+import threading
 from pathlib import Path
 from urllib.parse import unquote, urlparse
 
 import gi
-from patoolib import test_archive
-from patoolib.util import PatoolError
 
 from error_dialog import ErrorDialog
 
 gi.require_version("Gdk", "3.0")
+gi.require_version("GdkPixbuf", "2.0")
 gi.require_version("Gtk", "3.0")
-from gi.repository import Gdk, Gtk  # noqa: E402
+from gi.repository import Gdk, GdkPixbuf, GLib, Gtk  # noqa: E402
 
 
 class DropArea(Gtk.ListBox):
@@ -76,7 +76,11 @@ class DropArea(Gtk.ListBox):
         Args:
             file_path (str): a file path
         """
+        from patoolib import test_archive
+        from patoolib.util import PatoolError
+
         files_errors = []
+        rows_to_index = []
         for file_path in files_path:
             archive_path = Path(file_path)
             if archive_path.is_file() and not self.is_in_list(file_path):
@@ -90,6 +94,9 @@ class DropArea(Gtk.ListBox):
                     row.add(hbox)
 
                     label = Gtk.Label(label=file_path, xalign=0)
+                    image_thumbnail = Gtk.Image.new_from_icon_name("image-x-generic-symbolic", Gtk.IconSize.DND)
+                    label_info = Gtk.Label(label="", xalign=1)
+                    label_info.set_name("archive_info")
                     button_remove = Gtk.Button.new_from_icon_name("list-remove-symbolic", Gtk.IconSize.BUTTON)
                     button_remove.connect("clicked", self.on_button_remove)
 
@@ -104,14 +111,57 @@ class DropArea(Gtk.ListBox):
                     hbox_process.pack_start(image_error, False, True, 5)
 
                     hbox.pack_start(button_remove, False, True, 5)
+                    hbox.pack_start(image_thumbnail, False, True, 5)
                     hbox.pack_start(label, True, True, 5)
+                    hbox.pack_start(label_info, False, True, 5)
                     hbox.pack_start(hbox_process, False, True, 5)
                     self.add(row)
+                    rows_to_index.append((file_path, image_thumbnail, label_info))
 
         self.show_all()
+        if rows_to_index:
+            thread = threading.Thread(target=self.index_archives, args=(rows_to_index,))
+            thread.daemon = True
+            thread.start()
         if files_errors:
             ErrorDialog("Error while adding archives", files_errors)
 
+    def index_archives(self, rows: list):
+        """Read the metadata of the archives in the background and show it in their rows.
+
+        Args:
+            rows (list): a file path, its thumbnail image and its info label per row
+        """
+        from metadata_index import MetadataIndex
+
+        index = MetadataIndex()
+        try:
+            for file_path, image_thumbnail, label_info in rows:
+                try:
+                    metadata = index.get_or_read(file_path)
+                except Exception:
+                    continue
+                GLib.idle_add(self.show_metadata, metadata, image_thumbnail, label_info)
+        finally:
+            index.close()
+
+    def show_metadata(self, metadata: dict, image_thumbnail: Gtk.Image, label_info: Gtk.Label):
+        """Show the metadata of an archive in its row.
+
+        Args:
+            metadata (dict): the metadata
+            image_thumbnail (Gtk.Image): the thumbnail image of the row
+            label_info (Gtk.Label): the info label of the row
+        """
+        from metadata_index import MetadataIndex
+
+        label_info.set_text(MetadataIndex.get_text(metadata))
+        if metadata["thumbnail"]:
+            loader = GdkPixbuf.PixbufLoader.new()
+            loader.write(metadata["thumbnail"])
+            loader.close()
+            image_thumbnail.set_from_pixbuf(loader.get_pixbuf())
+
     def on_button_remove(self, button: Gtk.Button):
         """Remove the file path from the list.
 
@@ -132,7 +182,7 @@ class DropArea(Gtk.ListBox):
         for row in self.get_children():
             children = row.get_child().get_children()
             for widget in children:
-                if isinstance(widget, Gtk.Label):
+                if isinstance(widget, Gtk.Label) and widget.get_name() != "archive_info":
                     file_path = widget.get_text()
                 elif isinstance(widget, Gtk.HBox):
                     hbox = widget.get_children()
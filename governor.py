@@ -0,0 +1,134 @@
+"""Resource governor."""
+
+import os
+import subprocess
+import threading
+from contextlib import contextmanager
+from shutil import which
+
+from preferences import Preferences
+
+
+class Governor():
+    """Limit the resources used by the conversion.
+
+    In background mode the conversion threads run at a low CPU and I/O priority and the number of workers follows the
+    idle cores. In every mode the workers can be pinned to some cores, and their number and memory are capped.
+    """
+
+    # decoded image, converted image and encoder buffers, per pixel
+    BYTES_PER_PIXEL = 12
+
+    def __init__(self, preferences: Preferences):
+        """Initialize the governor from the preferences.
+
+        Args:
+            preferences (Preferences): the preferences
+        """
+        self.background = preferences.get_value("background_mode") == "true"
+        self.nice = int(preferences.get_value("background_nice") or preferences.DEFAULT_BACKGROUND_NICE)
+        self.max_workers = int(preferences.get_value("max_workers") or 0)
+        self.max_memory = int(preferences.get_value("max_memory") or 0) * 2**20
+        self.cores = self.parse_cores(preferences.get_value("cpu_cores") or "")
+
+        self.worker_count = 0
+        self.reserved_memory = 0
+        self.condition = threading.Condition()
+
+    @staticmethod
+    def parse_cores(text: str):
+        """Parse a list of cores such as "0-3,6".
+
+        Args:
+            text (str): a list of cores and ranges of cores
+
+        Returns:
+            set: the cores, empty for all cores
+        """
+        cores = set()
+        try:
+            for part in text.replace(" ", "").split(","):
+                if "-" in part:
+                    first, last = part.split("-")
+                    cores.update(range(int(first), int(last) + 1))
+                elif part:
+                    cores.add(int(part))
+        except ValueError:
+            return set()
+
+        return cores
+
+    def get_worker_count(self):
+        """Get the number of workers for the next archive.
+
+        Returns:
+            int: a number of workers
+        """
+        cores = len(self.cores) if self.cores else os.cpu_count() or 1
+        workers = min(self.max_workers, cores) if self.max_workers > 0 else cores
+
+        if self.background:
+            try:
+                load = os.getloadavg()[0]
+            except (AttributeError, OSError):
+                load = 0
+            # the load of the previous workers is ours
+            idle_cores = cores - max(load - self.worker_count, 0)
+            workers = min(workers, max(1, int(idle_cores)))
+
+        self.worker_count = workers
+        return workers
+
+    def apply_limits(self):
+        """Apply the priority and the cores to the calling thread, and the threads and processes it starts next.
+
+        The niceness, the I/O class and the cores are inherited by the new threads, so this runs once per conversion
+        thread, not per worker.
+        """
+        thread_id = threading.get_native_id()
+        if self.cores and hasattr(os, "sched_setaffinity"):
+            try:
+                os.sched_setaffinity(thread_id, self.cores)
+            except OSError:
+                pass
+
+        if not self.background:
+            return
+
+        if hasattr(os, "setpriority"):
+            try:
+                # the niceness of a thread can only be raised, so it is set once
+                if os.getpriority(os.PRIO_PROCESS, thread_id) < self.nice:
+                    os.setpriority(os.PRIO_PROCESS, thread_id, self.nice)
+            except OSError:
+                pass
+
+        if which("ionice"):
+            # idle I/O class, on Linux the priority of a thread is set by its id
+            subprocess.run(["ionice", "-c", "3", "-p", str(thread_id)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    @contextmanager
+    def reserve_memory(self, width: int, height: int):
+        """Wait until the memory needed to convert an image fits in the memory cap.
+
+        An image bigger than the cap is converted alone.
+
+        Args:
+            width (int): the image width
+            height (int): the image height
+        """
+        size = width * height * self.BYTES_PER_PIXEL
+        if self.max_memory <= 0:
+            yield
+            return
+
+        with self.condition:
+            while self.reserved_memory > 0 and self.reserved_memory + size > self.max_memory:
+                self.condition.wait()
+            self.reserved_memory += size
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.reserved_memory -= size
+                self.condition.notify_all()
@@ -1,7 +1,9 @@
 """Main."""
 
 
+import os
 import sys
+import time
 
 import gi
 
@@ -35,8 +37,22 @@ class Application(Gtk.Application):
         """When activating the application."""
         self.window = Window(self)
         self.window.resize(800, 600)
+        if os.environ.get("BALO_CONVERTER_STARTUP_BENCHMARK"):
+            self.window.connect_after("draw", self.on_first_draw)
         self.window.show_all()
 
+    def on_first_draw(self, widget: Gtk.Widget, context):
+        """Report the time of the first frame and quit, for the startup benchmark.
+
+        Args:
+            widget (Gtk.Widget): the window drawn
+            context (cairo.Context): a cairo context
+        """
+        widget.disconnect_by_func(self.on_first_draw)
+        print("first-window", time.monotonic(), flush=True)
+        self.quit()
+        return False
+
     def on_about(self, action: Gio.SimpleAction, param: None):
         """Open about dialog.
 
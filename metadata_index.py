@@ -0,0 +1,173 @@
+"""Metadata index."""
+
+import io
+import json
+import os
+import sqlite3
+import tarfile
+import threading
+import zipfile
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from PIL import Image
+from preferences import Preferences
+from streaming import StreamingExtractionError, StreamingExtractor
+
+from gi.repository import GLib
+
+
+class MetadataIndex():
+    """A persistent index of the archives metadata.
+
+    The entries are keyed by path, size and modification time, so a changed archive is read again. They hold the
+    member list, the page count, the dimensions and a thumbnail of the first image, and the uncompressed size.
+    """
+
+    THUMBNAIL_SIZE = (48, 64)
+
+    def __init__(self):
+        """Open the index."""
+        cache_dir = os.path.join(GLib.get_user_cache_dir(), "balo-converter")
+        os.makedirs(cache_dir, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(cache_dir, "metadata.sqlite"), timeout=10)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS archives (
+            path TEXT PRIMARY KEY, size INTEGER, mtime REAL, members TEXT, pages INTEGER,
+            width INTEGER, height INTEGER, uncompressed_size INTEGER, thumbnail BLOB)""")
+        self.connection.commit()
+        self.image_extensions = tuple(Image.registered_extensions())
+
+    def close(self):
+        """Close the index."""
+        self.connection.close()
+
+    def get(self, file_path: str):
+        """Get the metadata of an archive, if it is indexed and has not changed since.
+
+        Args:
+            file_path (str): file path
+
+        Returns:
+            dict: the metadata, or None
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+
+        row = self.connection.execute(
+            "SELECT members, pages, width, height, uncompressed_size, thumbnail FROM archives WHERE path = ? AND size = ? AND mtime = ?",
+            (file_path, stat.st_size, stat.st_mtime)).fetchone()
+        if row is None:
+            return None
+
+        members, pages, width, height, uncompressed_size, thumbnail = row
+        return {"members": json.loads(members), "pages": pages, "width": width, "height": height,
+                "size": stat.st_size, "uncompressed_size": uncompressed_size, "thumbnail": thumbnail}
+
+    def get_or_read(self, file_path: str):
+        """Get the metadata of an archive, reading the archive if it is not indexed.
+
+        Args:
+            file_path (str): file path
+
+        Returns:
+            dict: the metadata
+        """
+        metadata = self.get(file_path)
+        if metadata is None:
+            metadata = self.read(file_path)
+            stat = os.stat(file_path)
+            self.connection.execute("INSERT OR REPLACE INTO archives VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+                file_path, stat.st_size, stat.st_mtime, json.dumps(metadata["members"]), metadata["pages"],
+                metadata["width"], metadata["height"], metadata["uncompressed_size"], metadata["thumbnail"]))
+            self.connection.commit()
+
+        return metadata
+
+    def read(self, file_path: str):
+        """Read the metadata of an archive from its member list and its first image.
+
+        Zip and tar archives are read without extraction. The other formats are listed by an external tool which
+        extracts the images one by one until the first one opens; without the tool only the archive size is known.
+
+        Args:
+            file_path (str): file path
+
+        Returns:
+            dict: the metadata
+        """
+        size = os.path.getsize(file_path)
+        metadata = {"members": [], "pages": 0, "width": 0, "height": 0, "size": size, "uncompressed_size": size, "thumbnail": None}
+
+        if zipfile.is_zipfile(file_path):
+            with zipfile.ZipFile(file_path) as archive:
+                infos = [info for info in archive.infolist() if not info.is_dir()]
+                members = [(info.filename, info.file_size) for info in infos]
+                self.read_members(metadata, members, lambda name: archive.read(name))
+        elif tarfile.is_tarfile(file_path):
+            with tarfile.open(file_path) as archive:
+                infos = [info for info in archive.getmembers() if info.isfile()]
+                members = [(info.name, info.size) for info in infos]
+                self.read_members(metadata, members, lambda name: archive.extractfile(name).read())
+        elif StreamingExtractor.get_tool(file_path) is not None:
+            extractor = StreamingExtractor(file_path, 1, threading.Event())
+            with TemporaryDirectory(dir=Preferences().get_scratch_dir()) as extract_dir_path:
+                def read_member(name):
+                    extractor.extract_members([name], extract_dir_path)
+                    return Path(extract_dir_path, name).read_bytes()
+
+                try:
+                    self.read_members(metadata, extractor.list_member_sizes(), read_member)
+                except StreamingExtractionError:
+                    # the tool can not list this archive, or extract its pages such as encrypted ones
+                    pass
+
+        return metadata
+
+    def read_members(self, metadata: dict, members: list, read_member):
+        """Fill the metadata from the member list and the first image.
+
+        Args:
+            metadata (dict): the metadata filled
+            members (list): the name and size of each member
+            read_member (Callable): a function reading the bytes of a member from its name
+
+        Raises:
+            StreamingExtractionError: the external tool could not extract a page, the next ones are not tried
+        """
+        members = sorted(members)
+        pages = [name for name, size in members if name.lower().endswith(self.image_extensions)]
+        metadata["members"] = [name for name, size in members]
+        metadata["pages"] = len(pages)
+        metadata["uncompressed_size"] = sum(size for name, size in members)
+
+        for name in pages:
+            try:
+                with Image.open(io.BytesIO(read_member(name))) as image:
+                    metadata["width"], metadata["height"] = image.size
+                    image.thumbnail(self.THUMBNAIL_SIZE)
+                    thumbnail = io.BytesIO()
+                    image.convert("RGB").save(thumbnail, format="PNG")
+                    metadata["thumbnail"] = thumbnail.getvalue()
+                    return
+            except StreamingExtractionError:
+                raise
+            except Exception:
+                # It's not a picture
+                continue
+
+    @staticmethod
+    def get_text(metadata: dict):
+        """Format the metadata for the queue view.
+
+        Args:
+            metadata (dict): the metadata
+
+        Returns:
+            str: the page count, the dimensions of the first page and the size
+        """
+        text = "{0:.1f} MB".format(metadata["size"] / 2**20)
+        if metadata["pages"]:
+            text = "{0} pages - {1}x{2} - {3}".format(metadata["pages"], metadata["width"], metadata["height"], text)
+        return text
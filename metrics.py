@@ -0,0 +1,330 @@
+"""Metrics.
+
+Counters, gauges and histograms of the conversion engine, exported in the Prometheus text format by an optional
+local HTTP endpoint and as a periodic JSON snapshot file.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Tuple
+
+from preferences import Preferences
+
+
+class Metric():
+    """A metric with one value per set of labels."""
+
+    TYPE = "untyped"
+
+    def __init__(self, name: str, documentation: str):
+        """Initialize the metric.
+
+        Args:
+            name (str): the metric name
+            documentation (str): the help text
+        """
+        self.name = name
+        self.documentation = documentation
+        self.values = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(labels: dict):
+        """Get the key of a set of labels.
+
+        Args:
+            labels (dict): the labels
+
+        Returns:
+            tuple: the sorted labels
+        """
+        return tuple(sorted(labels.items()))
+
+    @staticmethod
+    def format_labels(key: tuple, extra: Tuple[str, str] = None):
+        """Format labels for the Prometheus text format.
+
+        Args:
+            key (tuple): the sorted labels
+            extra (Tuple[str, str]): a label added at the end
+
+        Returns:
+            str: the labels between braces, or an empty string
+        """
+        labels = list(key) + ([extra] if extra else [])
+        if not labels:
+            return ""
+        return "{" + ",".join('{0}="{1}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                              for name, value in labels) + "}"
+
+    def render(self):
+        """Render the metric in the Prometheus text format.
+
+        Returns:
+            List[str]: the lines
+        """
+        lines = ["# HELP {0} {1}".format(self.name, self.documentation), "# TYPE {0} {1}".format(self.name, self.TYPE)]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append("{0}{1} {2}".format(self.name, self.format_labels(key), value))
+        return lines
+
+    def snapshot(self):
+        """Get the values of the metric.
+
+        Returns:
+            list: a value and its labels per set of labels
+        """
+        with self.lock:
+            return [{"labels": dict(key), "value": value} for key, value in sorted(self.values.items())]
+
+
+class Counter(Metric):
+    """A value which only goes up."""
+
+    TYPE = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        """Increment the counter.
+
+        Args:
+            amount (float): the increment
+            labels (dict): the labels
+        """
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value which goes up and down."""
+
+    TYPE = "gauge"
+
+    def set(self, value: float, **labels):
+        """Set the gauge.
+
+        Args:
+            value (float): the value
+            labels (dict): the labels
+        """
+        with self.lock:
+            self.values[self.get_key(labels)] = value
+
+
+class Histogram(Metric):
+    """A distribution of values in buckets."""
+
+    TYPE = "histogram"
+    DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+    def __init__(self, name: str, documentation: str, buckets: List[float] = DEFAULT_BUCKETS):
+        """Initialize the histogram.
+
+        Args:
+            name (str): the metric name
+            documentation (str): the help text
+            buckets (List[float]): the upper bounds of the buckets
+        """
+        super().__init__(name, documentation)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value: float, **labels):
+        """Add a value to the histogram.
+
+        Args:
+            value (float): the value
+            labels (dict): the labels
+        """
+        key = self.get_key(labels)
+        with self.lock:
+            counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0, 0))
+            counts = [bucket_count + (value <= bound) for bucket_count, bound in zip(counts, self.buckets)]
+            self.values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a block, in seconds.
+
+        Args:
+            labels (dict): the labels
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def render(self):
+        """Render the histogram in the Prometheus text format.
+
+        Returns:
+            List[str]: the lines
+        """
+        lines = ["# HELP {0} {1}".format(self.name, self.documentation), "# TYPE {0} {1}".format(self.name, self.TYPE)]
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                for bucket_count, bound in zip(counts, self.buckets):
+                    lines.append("{0}_bucket{1} {2}".format(self.name, self.format_labels(key, ("le", bound)), bucket_count))
+                lines.append("{0}_bucket{1} {2}".format(self.name, self.format_labels(key, ("le", "+Inf")), count))
+                lines.append("{0}_sum{1} {2}".format(self.name, self.format_labels(key), total))
+                lines.append("{0}_count{1} {2}".format(self.name, self.format_labels(key), count))
+        return lines
+
+    def snapshot(self):
+        """Get the values of the histogram.
+
+        Returns:
+            list: the buckets, sum and count per set of labels
+        """
+        with self.lock:
+            return [{"labels": dict(key), "buckets": dict(zip(map(str, self.buckets), counts)), "sum": total, "count": count}
+                    for key, (counts, total, count) in sorted(self.values.items())]
+
+
+class Registry():
+    """The metrics of the process."""
+
+    def __init__(self):
+        """Initialize the registry."""
+        self.metrics = []
+
+    def register(self, metric: Metric):
+        """Add a metric.
+
+        Args:
+            metric (Metric): a metric
+
+        Returns:
+            Metric: the metric
+        """
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Render the metrics in the Prometheus text format.
+
+        Returns:
+            str: the metrics
+        """
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+    def snapshot(self):
+        """Get the values of the metrics.
+
+        Returns:
+            dict: the values per metric name, with the time of the snapshot
+        """
+        snapshot = {"time": time.time()}
+        for metric in self.metrics:
+            snapshot[metric.name] = metric.snapshot()
+        return snapshot
+
+
+REGISTRY = Registry()
+
+ARCHIVES = REGISTRY.register(Counter("balo_archives_total", "Archives processed, by result (converted, copied, failed)"))
+PAGES = REGISTRY.register(Counter("balo_pages_total", "Pages converted"))
+BYTES_READ = REGISTRY.register(Counter("balo_read_bytes_total", "Bytes of the source archives"))
+BYTES_WRITTEN = REGISTRY.register(Counter("balo_written_bytes_total", "Bytes of the output archives"))
+PREFETCH_HITS = REGISTRY.register(Counter("balo_prefetch_hits_total", "Archives already read ahead when their conversion started"))
+STREAMING_FALLBACKS = REGISTRY.register(Counter("balo_streaming_fallbacks_total",
+                                                "Archives extracted whole because the streaming extraction failed"))
+QUEUE_DEPTH = REGISTRY.register(Gauge("balo_queue_archives", "Archives waiting for conversion"))
+STAGE_DURATION = REGISTRY.register(Histogram("balo_stage_duration_seconds",
+                                             "Duration of the stages (scratch_wait, extract, convert, archive, copy)"))
+PAGE_DURATION = REGISTRY.register(Histogram("balo_page_duration_seconds", "Duration of the conversion of a page",
+                                            (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve the metrics in the Prometheus text format on /metrics and as JSON on /metrics.json."""
+
+    def do_GET(self):  # noqa: N802
+        """Answer a GET request."""
+        if self.path == "/metrics":
+            body = REGISTRY.render().encode()
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path == "/metrics.json":
+            body = json.dumps(REGISTRY.snapshot()).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args):
+        """Do not log the requests."""
+
+
+class Exporters():
+    """Start the HTTP endpoint and the JSON snapshot file set in the preferences, once per process."""
+
+    lock = threading.Lock()
+    server = None
+    snapshot_thread = None
+
+    @classmethod
+    def start(cls, preferences: Preferences):
+        """Start the exporters which are set and not started yet.
+
+        An exporter which can not start is skipped, it does not stop the conversion.
+
+        Args:
+            preferences (Preferences): the preferences
+
+        Returns:
+            List[str]: the errors of the exporters which could not start
+        """
+        errors = []
+        with cls.lock:
+            metrics_port = preferences.get_value("metrics_port")
+            if cls.server is None and metrics_port:
+                try:
+                    cls.server = ThreadingHTTPServer(("127.0.0.1", int(metrics_port)), MetricsHandler)
+                except (OSError, ValueError) as err:
+                    errors.append("Metrics endpoint on port {0}: {1}".format(metrics_port, err))
+                else:
+                    thread = threading.Thread(target=cls.server.serve_forever)
+                    thread.daemon = True
+                    thread.start()
+
+            metrics_file = preferences.get_value("metrics_file")
+            if cls.snapshot_thread is None and metrics_file:
+                try:
+                    interval = int(preferences.get_value("metrics_interval") or preferences.DEFAULT_METRICS_INTERVAL)
+                except ValueError as err:
+                    errors.append("Metrics snapshots: {0}".format(err))
+                else:
+                    cls.snapshot_thread = threading.Thread(target=cls.write_snapshots, args=(metrics_file, interval))
+                    cls.snapshot_thread.daemon = True
+                    cls.snapshot_thread.start()
+
+        return errors
+
+    @staticmethod
+    def write_snapshots(file_path: str, interval: int):
+        """Write a JSON snapshot of the metrics periodically.
+
+        Args:
+            file_path (str): the snapshot file, replaced at each write
+            interval (int): the time between two snapshots, in seconds
+        """
+        while True:
+            try:
+                tmp_path = file_path + ".tmp"
+                with open(tmp_path, "w") as file:
+                    json.dump(REGISTRY.snapshot(), file)
+                os.replace(tmp_path, file_path)
+            except OSError:
+                pass
+            time.sleep(interval)
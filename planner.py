@@ -0,0 +1,206 @@
+"""Dry-run planner."""
+
+import io
+import os
+import threading
+import time
+import zipfile
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import List
+
+from PIL import Image
+from converter import Converter
+from streaming import StreamingExtractionError, StreamingExtractor
+
+
+class Planner():
+    """Predict the output size and the conversion time of archives.
+
+    A fraction of the pages of each archive is read, converted in memory with the current preferences and written to
+    an in-memory archive, then the sizes and times are extrapolated to all the pages.
+    """
+
+    def __init__(self, files_path: List[str], fraction: float, event: threading.Event):
+        """Initialize the planner.
+
+        Args:
+            files_path (List[str]): the archives
+            fraction (float): the fraction of the pages converted, between 0 and 1
+            event (threading.Event): an event to signal a request to end processing
+        """
+        self.files_path = files_path
+        self.fraction = min(max(fraction, 0.001), 1)
+        self.event = event
+        self.converter = Converter([], event, lambda: None)
+        self.image_extensions = tuple(Image.registered_extensions())
+
+    def plan(self):
+        """Plan all the archives.
+
+        Returns:
+            List[dict]: a plan per archive
+        """
+        plans = []
+        for file_path in self.files_path:
+            if self.event.is_set():
+                break
+            try:
+                plans.append(self.plan_archive(file_path))
+            except Exception as err:
+                plans.append({"file_path": file_path, "error": str(err)})
+
+        return plans
+
+    def plan_archive(self, file_path: str):
+        """Plan an archive.
+
+        Args:
+            file_path (str): file path
+
+        Returns:
+            dict: the number of pages, the input and predicted output bytes and the predicted time in seconds
+        """
+        if self.converter.is_conformant_archive(file_path):
+            # copied as is, a conformant archive is always a zip
+            size = os.path.getsize(file_path)
+            with zipfile.ZipFile(file_path) as archive:
+                pages = len([info for info in archive.infolist() if info.filename.lower().endswith(self.image_extensions)])
+            return {"file_path": file_path, "pages": pages, "input_bytes": size, "output_bytes": size, "seconds": 0}
+
+        if zipfile.is_zipfile(file_path):
+            with zipfile.ZipFile(file_path) as archive:
+                members = [(info.filename, info.file_size) for info in archive.infolist() if not info.is_dir()]
+                return self.extrapolate(file_path, members, lambda name: archive.read(name))
+
+        scratch_dir_path = self.converter.get_scratch_dir()
+        if StreamingExtractor.get_tool(file_path) is not None:
+            extractor = StreamingExtractor(file_path, 1, self.event)
+            try:
+                members = extractor.list_member_sizes()
+            except StreamingExtractionError:
+                # the tool can not read this archive, patool may
+                members = None
+            if members is not None:
+                # only the sampled pages are extracted
+                sample = self.get_sample([member for member in members if member[0].lower().endswith(self.image_extensions)])
+                self.converter.wait_for_scratch_space(scratch_dir_path, sum(size for name, size in sample))
+                with TemporaryDirectory(dir=scratch_dir_path) as extract_dir_path:
+                    start = time.monotonic()
+                    extractor.extract_members([name for name, size in sample], extract_dir_path)
+                    extract_seconds = time.monotonic() - start
+                    return self.extrapolate(file_path, members, lambda name: Path(extract_dir_path, name).read_bytes(), extract_seconds)
+
+        self.converter.wait_for_scratch_space(scratch_dir_path, self.converter.estimate_scratch_space(file_path))
+        with TemporaryDirectory(dir=scratch_dir_path) as extract_dir_path:
+            start = time.monotonic()
+            self.converter.extract_archive(file_path, extract_dir_path)
+            extract_seconds = time.monotonic() - start
+            members = []
+            for root, dirs, files in os.walk(extract_dir_path):
+                for file_name in files:
+                    member_path = os.path.join(root, file_name)
+                    members.append((member_path, os.path.getsize(member_path)))
+            plan = self.extrapolate(file_path, members, lambda name: Path(name).read_bytes())
+            # the whole archive was extracted, there is nothing to extrapolate
+            plan["seconds"] += extract_seconds
+            return plan
+
+    def get_sample(self, pages: List[tuple]):
+        """Select the sampled pages.
+
+        Args:
+            pages (List[tuple]): the name and size of each page
+
+        Returns:
+            List[tuple]: evenly spaced pages, at least one
+        """
+        step = max(1, round(1 / self.fraction))
+        return pages[::step]
+
+    def extrapolate(self, file_path: str, members: List[tuple], read_member, extract_seconds: float = 0):
+        """Convert a sample of the pages and extrapolate to the whole archive.
+
+        The pages are converted by several workers, while reading and writing the archive happen on one thread.
+
+        Args:
+            file_path (str): file path
+            members (List[tuple]): the name and size of each member
+            read_member (Callable): a function reading the bytes of a member from its name
+            extract_seconds (float): the time spent extracting the sampled pages before reading them
+
+        Returns:
+            dict: the number of pages, the input and predicted output bytes and the predicted time in seconds
+        """
+        pages = [member for member in members if member[0].lower().endswith(self.image_extensions)]
+        other_bytes = sum(size for name, size in members) - sum(size for name, size in pages)
+        image_format, max_size = self.converter.get_image_settings()
+        max_bytes = self.converter.get_target_page_bytes(len(pages))
+
+        sample_input_bytes = 0
+        sample_output_bytes = 0
+        sample_seconds = 0
+        sample_serial_seconds = extract_seconds
+        sample_pages = 0
+        with zipfile.ZipFile(io.BytesIO(), "w", zipfile.ZIP_DEFLATED) as output_archive:
+            for name, size in self.get_sample(pages):
+                if self.event.is_set():
+                    raise Exception("Dry run stopped by user")
+                start = time.monotonic()
+                data = read_member(name)
+                sample_serial_seconds += time.monotonic() - start
+
+                start = time.monotonic()
+                output = io.BytesIO()
+                try:
+                    with Image.open(io.BytesIO(data)) as image:
+                        self.converter.encode_image(image, output, image_format, max_size, max_bytes)
+                except Exception:
+                    # It's not a picture, it would be copied as is
+                    output = io.BytesIO(data)
+                sample_seconds += time.monotonic() - start
+
+                start = time.monotonic()
+                output_archive.writestr(str(sample_pages), output.getvalue())
+                sample_serial_seconds += time.monotonic() - start
+                sample_input_bytes += size
+                sample_output_bytes += len(output.getvalue())
+                sample_pages += 1
+
+        pages_bytes = sum(size for name, size in pages)
+        ratio = sample_output_bytes / sample_input_bytes if sample_input_bytes else 1
+        seconds = 0
+        if sample_pages:
+            seconds = (sample_seconds / self.converter.governor.get_worker_count() + sample_serial_seconds) / sample_pages * len(pages)
+
+        return {"file_path": file_path, "pages": len(pages), "input_bytes": pages_bytes + other_bytes,
+                "output_bytes": int(pages_bytes * ratio) + other_bytes, "seconds": seconds}
+
+    @staticmethod
+    def get_report(plans: List[dict]):
+        """Format the plans.
+
+        Args:
+            plans (List[dict]): the plans
+
+        Returns:
+            str: a line per archive and a line for the total
+        """
+        def format_plan(name: str, plan: dict):
+            ratio = plan["output_bytes"] / plan["input_bytes"] if plan["input_bytes"] else 1
+            seconds = int(plan["seconds"])
+            return "{0}: {1} pages, {2:.1f} MB -> {3:.1f} MB (x{4:.2f}), {5} min {6:02d} s".format(
+                name, plan["pages"], plan["input_bytes"] / 2**20, plan["output_bytes"] / 2**20, ratio, seconds // 60, seconds % 60)
+
+        lines = []
+        total = {"pages": 0, "input_bytes": 0, "output_bytes": 0, "seconds": 0}
+        for plan in plans:
+            if "error" in plan:
+                lines.append("{0}: {1}".format(Path(plan["file_path"]).name, plan["error"]))
+                continue
+            lines.append(format_plan(Path(plan["file_path"]).name, plan))
+            for key in total:
+                total[key] += plan[key]
+
+        lines.append(format_plan("Total", total))
+        return "\n".join(lines)
@@ -18,12 +18,26 @@ class Preferences():
     OUTPUT_SAME_FOLDER = "SAME"
     OUTPUT_SELECTED_FOLDER = "SELECTED"
 
+    SCRATCH_SYSTEM_FOLDER = "SYSTEM"
+    SCRATCH_SELECTED_FOLDER = "SELECTED"
+
+    TARGET_NO_SIZE = "NONE"
+    TARGET_ARCHIVE_SIZE = "ARCHIVE"
+    TARGET_PAGE_SIZE = "PAGE"
+
     OUTPUT_ORIGINAL_IMAGE_SIZE = "ORIGINAL"
     OUTPUT_CUSTOM_IMAGE_SIZE = "CUSTOM"
 
     DEFAULT_IMAGE_WIDTH = "400"
     DEFAULT_IMAGE_HEIGHT = "800"
     DEFAULT_IMAGE_FORMAT = "png"
+    DEFAULT_SCRATCH_WAIT = "0"
+    DEFAULT_PREFETCH_SIZE = "512"
+    DEFAULT_BACKGROUND_NICE = "10"
+    DEFAULT_METRICS_INTERVAL = "10"
+    DEFAULT_DRY_RUN_SAMPLE = "5"
+    DEFAULT_TARGET_SIZE = "51200"
+    DEFAULT_STREAM_BATCH_SIZE = "32"
     DEFAULT_GROUP = "preferences"
 
     def __init__(self):
@@ -48,6 +62,24 @@ class Preferences():
             self.key_file.set_value(self.DEFAULT_GROUP, "image_size", self.OUTPUT_ORIGINAL_IMAGE_SIZE)
             self.key_file.set_value(self.DEFAULT_GROUP, "image_width", self.DEFAULT_IMAGE_WIDTH)
             self.key_file.set_value(self.DEFAULT_GROUP, "image_height", self.DEFAULT_IMAGE_HEIGHT)
+            self.key_file.set_value(self.DEFAULT_GROUP, "scratch_location", self.SCRATCH_SYSTEM_FOLDER)
+            self.key_file.set_value(self.DEFAULT_GROUP, "scratch_folder", str(Path.home()))
+            self.key_file.set_value(self.DEFAULT_GROUP, "scratch_wait", self.DEFAULT_SCRATCH_WAIT)
+            self.key_file.set_value(self.DEFAULT_GROUP, "prefetch_size", self.DEFAULT_PREFETCH_SIZE)
+            self.key_file.set_value(self.DEFAULT_GROUP, "background_mode", "false")
+            self.key_file.set_value(self.DEFAULT_GROUP, "background_nice", self.DEFAULT_BACKGROUND_NICE)
+            self.key_file.set_value(self.DEFAULT_GROUP, "max_workers", "0")
+            self.key_file.set_value(self.DEFAULT_GROUP, "max_memory", "0")
+            self.key_file.set_value(self.DEFAULT_GROUP, "cpu_cores", "")
+            self.key_file.set_value(self.DEFAULT_GROUP, "metrics_port", "")
+            self.key_file.set_value(self.DEFAULT_GROUP, "metrics_file", "")
+            self.key_file.set_value(self.DEFAULT_GROUP, "metrics_interval", self.DEFAULT_METRICS_INTERVAL)
+            self.key_file.set_value(self.DEFAULT_GROUP, "dry_run_sample", self.DEFAULT_DRY_RUN_SAMPLE)
+            self.key_file.set_value(self.DEFAULT_GROUP, "target_size_mode", self.TARGET_NO_SIZE)
+            self.key_file.set_value(self.DEFAULT_GROUP, "target_size", self.DEFAULT_TARGET_SIZE)
+            self.key_file.set_value(self.DEFAULT_GROUP, "streaming_extraction", "true")
+            self.key_file.set_value(self.DEFAULT_GROUP, "stream_batch_size", self.DEFAULT_STREAM_BATCH_SIZE)
+            self.key_file.set_value(self.DEFAULT_GROUP, "verify_output", "true")
             self.key_file.save_to_file(self.config_file)
 
     def set_value(self, key: str, value: Union[str, int]):
@@ -57,9 +89,31 @@ class Preferences():
             key (str): a key
             value (Union[str, int]): a value
         """
+        try:
+            # keep the values saved meanwhile by another instance, such as the measures of the converter
+            self.key_file.load_from_file(self.config_file, GLib.KeyFileFlags.KEEP_TRANSLATIONS)
+        except Exception:
+            pass
         self.key_file.set_value(self.DEFAULT_GROUP, key, value)
         self.key_file.save_to_file(self.config_file)
 
+    def get_scratch_dir(self):
+        """Get the directory where the archives are extracted and converted.
+
+        Raises:
+            Exception: the selected folder does not exist
+
+        Returns:
+            str: a directory path, or None for the system temporary directory
+        """
+        if self.get_value("scratch_location") == self.SCRATCH_SELECTED_FOLDER:
+            scratch_dir_path = self.get_value("scratch_folder")
+            if scratch_dir_path is None or not Path(scratch_dir_path).is_dir():
+                raise Exception("Scratch folder does not exist: " + str(scratch_dir_path))
+            return scratch_dir_path
+
+        return None
+
     def get_value(self, key: str):
         """Set the value for a key in the key file.
 
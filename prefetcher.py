@@ -0,0 +1,138 @@
+"""Prefetcher."""
+
+import os
+import threading
+from typing import List
+
+
+class Prefetcher():
+    """Read the next queued archives ahead of time.
+
+    The archives are read into the page cache by a background thread while the current archive is converted, so
+    archives on slow storage (NFS, SMB) do not pay the network latency when their turn comes.
+    """
+
+    CHUNK_SIZE = 2**20
+
+    def __init__(self, files_path: List[str], budget: int, event: threading.Event):
+        """Initialize the prefetcher.
+
+        Args:
+            files_path (List[str]): the queued file paths, in conversion order
+            budget (int): the maximum number of bytes read ahead of the archive being converted
+            event (threading.Event): an event to signal a request to end processing
+        """
+        self.files_path = files_path
+        self.budget = budget
+        self.event = event
+
+        self.position = 0
+        self.stopped = False
+        self.files_size = {}
+        self.prefetched = set()
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def start(self):
+        """Start reading ahead."""
+        if self.budget > 0:
+            self.thread.start()
+
+    def stop(self):
+        """Stop reading ahead."""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def advance(self, position: int):
+        """Signal that the converter has moved on to another archive.
+
+        Args:
+            position (int): the position of the archive being converted
+        """
+        with self.condition:
+            self.position = position
+            self.condition.notify()
+
+    def is_prefetched(self, index: int):
+        """Check if an archive was entirely read ahead.
+
+        Args:
+            index (int): the position of the archive
+
+        Returns:
+            bool: return true if the archive was read up to its end
+        """
+        return index in self.prefetched
+
+    def is_cancelled(self, index: int = None):
+        """Check if reading ahead must stop.
+
+        Args:
+            index (int): the position of the archive being read ahead
+
+        Returns:
+            bool: return true if the prefetcher is stopped or the archive is already being converted
+        """
+        return self.stopped or self.event.is_set() or (index is not None and index <= self.position)
+
+    def get_file_size(self, index: int):
+        """Get the size of a queued archive.
+
+        Args:
+            index (int): the position of the archive
+
+        Returns:
+            int: a number of bytes, 0 if the file can not be read
+        """
+        if index not in self.files_size:
+            try:
+                self.files_size[index] = os.path.getsize(self.files_path[index])
+            except OSError:
+                self.files_size[index] = 0
+
+        return self.files_size[index]
+
+    def run(self):
+        """Read the next archives as long as they fit in the budget."""
+        index = 0
+        while True:
+            with self.condition:
+                while True:
+                    if self.is_cancelled():
+                        return
+                    index = max(index, self.position + 1)
+                    if index >= len(self.files_path):
+                        return
+                    if self.get_file_size(index) > self.budget:
+                        # too big to be read ahead
+                        index += 1
+                        continue
+                    # the archives skipped as too big are not read ahead, so they do not take up the budget
+                    ahead_size = sum(size for size in map(self.get_file_size, range(self.position + 1, index + 1)) if size <= self.budget)
+                    if ahead_size <= self.budget:
+                        break
+                    self.condition.wait()
+
+            self.prefetch(index)
+            index += 1
+
+    def prefetch(self, index: int):
+        """Read an archive into the page cache.
+
+        Args:
+            index (int): the position of the archive
+        """
+        try:
+            with open(self.files_path[index], "rb") as file:
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                # network filesystems often ignore the advice, so the file is read too
+                while not self.is_cancelled(index):
+                    if not file.read(self.CHUNK_SIZE):
+                        self.prefetched.add(index)
+                        break
+        except OSError:
+            # the converter will report the error
+            pass
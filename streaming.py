@@ -0,0 +1,253 @@
+"""Streaming extraction."""
+
+import os
+import subprocess
+import tarfile
+import threading
+from pathlib import Path, PurePosixPath
+from shutil import rmtree, which
+from tempfile import mkdtemp
+from typing import List
+
+
+class StreamingExtractionError(Exception):
+    """The external tool could not list or extract the archive."""
+
+
+class StreamingExtractor():
+    """Extract a non-zip archive in bounded batches of members.
+
+    Tar archives are read as a stream. The other formats are listed, then each batch of members is extracted by an
+    external tool (unrar for rar archives, else 7z), so the scratch space holds one batch instead of the whole archive.
+    """
+
+    SEVEN_ZIP_TOOLS = ("7zz", "7z", "7za")
+    SEVEN_ZIP_FORMATS = (".7z", ".cb7", ".rar", ".cbr")
+    RAR_FORMATS = (".rar", ".cbr")
+
+    def __init__(self, file_path: str, batch_size: int, event: threading.Event):
+        """Initialize the extractor.
+
+        Args:
+            file_path (str): file path
+            batch_size (int): the maximum number of members in a batch
+            event (threading.Event): an event to signal a request to end processing
+        """
+        self.file_path = file_path
+        self.batch_size = max(batch_size, 1)
+        self.event = event
+        self.tool = self.get_tool(file_path)
+        self.members = None
+
+    @classmethod
+    def get_tool(cls, file_path: str):
+        """Get the tool extracting the members of an archive.
+
+        Args:
+            file_path (str): file path
+
+        Returns:
+            str: "tar", a 7z executable, "unrar", or None if the archive can not be streamed
+        """
+        if tarfile.is_tarfile(file_path):
+            return "tar"
+
+        suffix = Path(file_path).suffix.lower()
+        # many 7z builds have no RAR codec
+        if suffix in cls.RAR_FORMATS and which("unrar"):
+            return "unrar"
+        if suffix in cls.SEVEN_ZIP_FORMATS:
+            for tool in cls.SEVEN_ZIP_TOOLS:
+                if which(tool):
+                    return tool
+
+        return None
+
+    @staticmethod
+    def is_safe_member(name: str):
+        """Check that a member is extracted inside the batch folder.
+
+        Args:
+            name (str): the member name
+
+        Returns:
+            bool: return true if the name is relative and does not go up
+        """
+        path = PurePosixPath(name.replace("\\", "/"))
+        return not path.is_absolute() and ".." not in path.parts
+
+    def list_members(self):
+        """List the files of the archive, once.
+
+        Raises:
+            StreamingExtractionError: the archive could not be listed
+
+        Returns:
+            List[str]: the member names, in archive order
+        """
+        return [name for name, size in self.list_member_sizes()]
+
+    def list_member_sizes(self):
+        """List the files of the archive and their uncompressed size, once.
+
+        Raises:
+            StreamingExtractionError: the archive could not be listed, or has no member
+
+        Returns:
+            List[tuple]: the name and size of each member, in archive order
+        """
+        if self.members is None:
+            try:
+                members = self.read_members()
+            except (OSError, ValueError, subprocess.CalledProcessError, tarfile.TarError) as err:
+                raise StreamingExtractionError("Can not list {0}: {1}".format(self.file_path, err))
+            # an empty list is more likely a listing not understood than an empty archive
+            if not members:
+                raise StreamingExtractionError("No member listed in " + self.file_path)
+            self.members = members
+
+        return self.members
+
+    def read_members(self):
+        """Read the names and sizes of the files of the archive.
+
+        Returns:
+            List[tuple]: the name and size of each member, in archive order
+        """
+        if self.tool == "tar":
+            with tarfile.open(self.file_path) as archive:
+                return [(member.name, member.size) for member in archive.getmembers() if member.isfile() and self.is_safe_member(member.name)]
+
+        if self.tool == "unrar":
+            # technical listing, one "Name: ..." block per member
+            output = subprocess.run(["unrar", "lt", "-p-", "--", self.file_path], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL, check=True, text=True).stdout
+            separator, name_key, size_key = ": ", "Name", "Size"
+        else:
+            output = subprocess.run([self.tool, "l", "-slt", "-ba", "--", self.file_path], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL, check=True, text=True).stdout
+            separator, name_key, size_key = " = ", "Path", "Size"
+
+        members = []
+        for block in output.split("\n\n"):
+            fields = dict(line.strip().split(separator, 1) for line in block.splitlines() if separator in line)
+            if self.tool == "unrar":
+                is_file = fields.get("Type") == "File"
+            else:
+                # the folders have "Folder = +" or a D attribute, the archive itself is described by a block without Size
+                attributes = fields.get("Attributes", "").split(" ")[0]
+                is_file = size_key in fields and fields.get("Folder") != "+" and "D" not in attributes
+            if is_file and name_key in fields and self.is_safe_member(fields[name_key]):
+                members.append((fields[name_key], int(fields.get(size_key) or 0)))
+        return members
+
+    def extract_members(self, names: List[str], batch_dir_path: str):
+        """Extract some members.
+
+        Args:
+            names (List[str]): the member names
+            batch_dir_path (str): the folder where the members are extracted
+
+        Raises:
+            StreamingExtractionError: the members could not be extracted
+        """
+        try:
+            if self.tool == "tar":
+                wanted = set(names)
+                with tarfile.open(self.file_path) as archive:
+                    for member in archive.getmembers():
+                        if member.name in wanted and member.isfile():
+                            self.write_tar_member(archive, member, batch_dir_path)
+                return
+
+            if self.tool == "unrar":
+                command = ["unrar", "x", "-inul", "-y", "-p-", "--", self.file_path] + names + [batch_dir_path + os.sep]
+            else:
+                # -spd: the names are not wildcards
+                command = [self.tool, "x", "-y", "-bd", "-spd", "-o" + batch_dir_path, "--", self.file_path] + names
+            subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        except (OSError, subprocess.CalledProcessError, tarfile.TarError) as err:
+            raise StreamingExtractionError("Can not extract {0}: {1}".format(self.file_path, err))
+
+    @staticmethod
+    def write_tar_member(archive: tarfile.TarFile, member: tarfile.TarInfo, batch_dir_path: str):
+        """Write a tar member into a batch folder.
+
+        Args:
+            archive (tarfile.TarFile): the tar archive
+            member (tarfile.TarInfo): the member
+            batch_dir_path (str): the batch folder
+        """
+        member_path = Path(batch_dir_path, member.name)
+        member_path.parent.mkdir(parents=True, exist_ok=True)
+        with archive.extractfile(member) as source, open(member_path, "wb") as destination:
+            while True:
+                chunk = source.read(2**20)
+                if not chunk:
+                    break
+                destination.write(chunk)
+
+    def batches(self, scratch_dir_path: str = None):
+        """Extract the archive batch by batch.
+
+        Each batch folder is yielded once complete, and must be removed by the caller.
+
+        Args:
+            scratch_dir_path (str): the folder where the batch folders are created, None for the system temporary folder
+
+        Yields:
+            str: a batch folder
+        """
+        if self.tool == "tar":
+            yield from self.tar_batches(scratch_dir_path)
+            return
+
+        members = self.list_members()
+        for start in range(0, len(members), self.batch_size):
+            if self.event.is_set():
+                raise Exception("Conversion stopped by user")
+            batch_dir_path = mkdtemp(dir=scratch_dir_path)
+            try:
+                self.extract_members(members[start:start + self.batch_size], batch_dir_path)
+            except Exception:
+                rmtree(batch_dir_path)
+                raise
+            yield batch_dir_path
+
+    def tar_batches(self, scratch_dir_path: str = None):
+        """Read a tar archive as a stream, batch by batch.
+
+        Args:
+            scratch_dir_path (str): the folder where the batch folders are created, None for the system temporary folder
+
+        Yields:
+            str: a batch folder
+        """
+        batch_dir_path = None
+        count = 0
+        try:
+            try:
+                archive = tarfile.open(self.file_path, "r|*")
+            except (OSError, tarfile.TarError) as err:
+                raise StreamingExtractionError("Can not extract {0}: {1}".format(self.file_path, err))
+            with archive:
+                for member in archive:
+                    if self.event.is_set():
+                        raise Exception("Conversion stopped by user")
+                    if not member.isfile() or not self.is_safe_member(member.name):
+                        continue
+                    if batch_dir_path is None:
+                        batch_dir_path = mkdtemp(dir=scratch_dir_path)
+                    self.write_tar_member(archive, member, batch_dir_path)
+                    count += 1
+                    if count == self.batch_size:
+                        # from now on the batch folder belongs to the caller
+                        ready_dir_path, batch_dir_path = batch_dir_path, None
+                        count = 0
+                        yield ready_dir_path
+            if batch_dir_path is not None:
+                ready_dir_path, batch_dir_path = batch_dir_path, None
+                yield ready_dir_path
+        finally:
+            if batch_dir_path is not None:
+                rmtree(batch_dir_path)
@@ -3,8 +3,6 @@
 import glob
 import threading
 from pathlib import Path
-from patoolib import ArchiveFormats, ArchiveMimetypes
-from converter import Converter
 from drop_area import DropArea
 from preferences import Preferences
 
@@ -12,7 +10,7 @@ import gi
 
 
 gi.require_version("Gtk", "3.0")
-from gi.repository import Gio, Gtk  # noqa: E402
+from gi.repository import Gio, GLib, Gtk  # noqa: E402
 
 
 class Window(Gtk.ApplicationWindow):
@@ -32,15 +30,17 @@ class Window(Gtk.ApplicationWindow):
         self.set_icon_from_file("baloconverter.ico")
 
         self.icon_size = Gtk.IconSize.LARGE_TOOLBAR
-        self.extentions = ArchiveFormats + ("cbz", "cbr")
         self.event_run = threading.Event()
         self.thread_run = None
+        self.thread_dry_run = None
+        self.event_dry_run = threading.Event()
 
         self.preferences = Preferences()
 
         self.create_action()
         self.create_header_bar()
-        self.create_popover_preferences()
+        # the popover is built on first use, see on_preferences
+        self.popover = None
 
         self.drop_area = DropArea()
         scrolled_window = Gtk.ScrolledWindow()
@@ -74,6 +74,11 @@ class Window(Gtk.ApplicationWindow):
         action_run.connect("activate", self.on_run)
         self.add_action(action_run)
 
+        # dry run
+        action_dry_run = Gio.SimpleAction.new("dry_run")
+        action_dry_run.connect("activate", self.on_dry_run)
+        self.add_action(action_dry_run)
+
         # preferences
         action_preferences = Gio.SimpleAction.new("preferences")
         action_preferences.connect("activate", self.on_preferences)
@@ -118,6 +123,13 @@ class Window(Gtk.ApplicationWindow):
         header_bar.pack_start(self.button_run)
         self.button_run.set_action_name("win.run")
 
+        # dry run
+        icon_dry_run = Gtk.Image.new_from_icon_name("edit-find-symbolic", self.icon_size)
+        self.button_dry_run = Gtk.ToolButton.new(icon_dry_run, "Estimate output size and time")
+        self.button_dry_run.set_tooltip_text("Estimate output size and time")
+        header_bar.pack_start(self.button_dry_run)
+        self.button_dry_run.set_action_name("win.dry_run")
+
         # about
         icon_about = Gtk.Image.new_from_icon_name("help-about-symbolic", self.icon_size)
         button_about = Gtk.ToolButton.new(icon_about, "About")
@@ -170,6 +182,136 @@ class Window(Gtk.ApplicationWindow):
 
         vbox.add(hbox_same_folder)
 
+        # Label scratch folder
+        label_scratch_folder = Gtk.Label(xalign=0)
+        label_scratch_folder.set_margin_left(5)
+        label_scratch_folder.set_markup("<b> Scratch folder</b>")
+        vbox.pack_start(label_scratch_folder, expand=True, fill=True, padding=10)
+
+        # Button system temporary folder
+        radio_button_system_scratch_folder = Gtk.RadioButton.new_with_label_from_widget(None, "In the system temporary folder")
+        radio_button_system_scratch_folder.set_margin_left(20)
+        radio_button_system_scratch_folder.connect("toggled", self.on_button_scratch_folder_toggled, self.preferences.SCRATCH_SYSTEM_FOLDER)
+        vbox.add(radio_button_system_scratch_folder)
+
+        # Button selected scratch folder
+        hbox_scratch_folder = Gtk.HBox()
+
+        self.radio_button_selected_scratch_folder = Gtk.RadioButton.new_with_label_from_widget(
+            radio_button_system_scratch_folder, "In the folder " + (self.preferences.get_value("scratch_folder") or ""))
+        self.radio_button_selected_scratch_folder.set_margin_left(20)
+        self.radio_button_selected_scratch_folder.connect("toggled", self.on_button_scratch_folder_toggled,
+                                                          self.preferences.SCRATCH_SELECTED_FOLDER)
+        hbox_scratch_folder.add(self.radio_button_selected_scratch_folder)
+
+        if self.preferences.get_value("scratch_location") == self.preferences.SCRATCH_SELECTED_FOLDER:
+            self.radio_button_selected_scratch_folder.set_active(True)
+
+        # Button select scratch folder
+        button_select_scratch_folder = Gtk.Button(label="Browse...")
+        button_select_scratch_folder.set_image(Gtk.Image.new_from_icon_name("document-open-symbolic", Gtk.IconSize.BUTTON))
+        button_select_scratch_folder.set_always_show_image(True)
+        button_select_scratch_folder.connect("clicked", self.on_button_select_scratch_folder)
+        hbox_scratch_folder.add(button_select_scratch_folder)
+
+        vbox.add(hbox_scratch_folder)
+
+        # Entry scratch wait
+        hbox_scratch_wait = Gtk.HBox()
+
+        label_scratch_wait = Gtk.Label("Wait for free space (seconds)", xalign=0)
+        hbox_scratch_wait.pack_start(label_scratch_wait, expand=False, fill=False, padding=20)
+
+        entry_scratch_wait = Gtk.Entry()
+        entry_scratch_wait.set_text(self.preferences.get_value("scratch_wait") or self.preferences.DEFAULT_SCRATCH_WAIT)
+        entry_scratch_wait.set_width_chars(5)
+        entry_scratch_wait.connect("changed", self.on_entry_scratch_wait_changed)
+        hbox_scratch_wait.pack_start(entry_scratch_wait, expand=False, fill=False, padding=0)
+
+        vbox.add(hbox_scratch_wait)
+
+        # Entry prefetch size
+        hbox_prefetch_size = Gtk.HBox()
+
+        label_prefetch_size = Gtk.Label("Read the next archives ahead (MB)", xalign=0)
+        hbox_prefetch_size.pack_start(label_prefetch_size, expand=False, fill=False, padding=20)
+
+        entry_prefetch_size = Gtk.Entry()
+        entry_prefetch_size.set_text(self.preferences.get_value("prefetch_size") or self.preferences.DEFAULT_PREFETCH_SIZE)
+        entry_prefetch_size.set_width_chars(5)
+        entry_prefetch_size.connect("changed", self.on_entry_prefetch_size_changed)
+        hbox_prefetch_size.pack_start(entry_prefetch_size, expand=False, fill=False, padding=0)
+
+        vbox.add(hbox_prefetch_size)
+
+        # Label resources
+        label_resources = Gtk.Label(xalign=0)
+        label_resources.set_margin_left(5)
+        label_resources.set_markup("<b> Resources</b>")
+        vbox.pack_start(label_resources, expand=True, fill=True, padding=10)
+
+        # Button background mode
+        check_button_background_mode = Gtk.CheckButton(label="Run in the background (low priority, follows the idle cores)")
+        check_button_background_mode.set_margin_left(20)
+        check_button_background_mode.set_active(self.preferences.get_value("background_mode") == "true")
+        check_button_background_mode.connect("toggled", self.on_button_background_mode_toggled)
+        vbox.add(check_button_background_mode)
+
+        # Entry max workers
+        hbox_resources = Gtk.HBox()
+
+        label_max_workers = Gtk.Label("Workers", xalign=0)
+        hbox_resources.pack_start(label_max_workers, expand=False, fill=False, padding=20)
+
+        entry_max_workers = Gtk.Entry()
+        entry_max_workers.set_text(self.preferences.get_value("max_workers") or "0")
+        entry_max_workers.set_width_chars(3)
+        entry_max_workers.set_tooltip_text("0 for one worker per core")
+        entry_max_workers.connect("changed", self.on_entry_max_workers_changed)
+        hbox_resources.pack_start(entry_max_workers, expand=False, fill=False, padding=0)
+
+        # Entry cores
+        label_cpu_cores = Gtk.Label("Cores", xalign=0)
+        label_cpu_cores.set_margin_left(5)
+        label_cpu_cores.set_margin_right(5)
+        hbox_resources.add(label_cpu_cores)
+
+        entry_cpu_cores = Gtk.Entry()
+        entry_cpu_cores.set_text(self.preferences.get_value("cpu_cores") or "")
+        entry_cpu_cores.set_width_chars(8)
+        entry_cpu_cores.set_tooltip_text("For example 0-3,6, empty for all cores")
+        entry_cpu_cores.connect("changed", self.on_entry_cpu_cores_changed)
+        hbox_resources.add(entry_cpu_cores)
+
+        # Entry max memory
+        label_max_memory = Gtk.Label("Memory (MB)", xalign=0)
+        label_max_memory.set_margin_left(5)
+        label_max_memory.set_margin_right(5)
+        hbox_resources.add(label_max_memory)
+
+        entry_max_memory = Gtk.Entry()
+        entry_max_memory.set_text(self.preferences.get_value("max_memory") or "0")
+        entry_max_memory.set_width_chars(6)
+        entry_max_memory.set_tooltip_text("0 for no limit")
+        entry_max_memory.connect("changed", self.on_entry_max_memory_changed)
+        hbox_resources.add(entry_max_memory)
+
+        vbox.add(hbox_resources)
+
+        # Entry dry run sample
+        hbox_dry_run_sample = Gtk.HBox()
+
+        label_dry_run_sample = Gtk.Label("Pages sampled by the estimate (%)", xalign=0)
+        hbox_dry_run_sample.pack_start(label_dry_run_sample, expand=False, fill=False, padding=20)
+
+        entry_dry_run_sample = Gtk.Entry()
+        entry_dry_run_sample.set_text(self.preferences.get_value("dry_run_sample") or self.preferences.DEFAULT_DRY_RUN_SAMPLE)
+        entry_dry_run_sample.set_width_chars(3)
+        entry_dry_run_sample.connect("changed", self.on_entry_dry_run_sample_changed)
+        hbox_dry_run_sample.pack_start(entry_dry_run_sample, expand=False, fill=False, padding=0)
+
+        vbox.add(hbox_dry_run_sample)
+
         # Label output archive format
         label_output_formats = Gtk.Label(xalign=0)
         label_output_formats.set_margin_left(5)
@@ -273,6 +415,36 @@ class Window(Gtk.ApplicationWindow):
 
         vbox.add(hbox_custom_image_size)
 
+        # Label output size target
+        label_target_size = Gtk.Label(xalign=0)
+        label_target_size.set_margin_left(5)
+        label_target_size.set_markup("<b> Output size target</b>")
+        vbox.pack_start(label_target_size, expand=True, fill=True, padding=10)
+
+        hbox_target_size = Gtk.HBox()
+
+        # Combo target size mode
+        combo_target_size_mode = Gtk.ComboBoxText()
+        combo_target_size_mode.append(self.preferences.TARGET_NO_SIZE, "No target")
+        combo_target_size_mode.append(self.preferences.TARGET_ARCHIVE_SIZE, "Per archive")
+        combo_target_size_mode.append(self.preferences.TARGET_PAGE_SIZE, "Per page")
+        combo_target_size_mode.set_active_id(self.preferences.get_value("target_size_mode") or self.preferences.TARGET_NO_SIZE)
+        combo_target_size_mode.connect("changed", self.combo_target_size_mode_changed)
+        hbox_target_size.pack_start(combo_target_size_mode, expand=False, fill=False, padding=20)
+
+        # Entry target size
+        entry_target_size = Gtk.Entry()
+        entry_target_size.set_text(self.preferences.get_value("target_size") or self.preferences.DEFAULT_TARGET_SIZE)
+        entry_target_size.set_width_chars(8)
+        entry_target_size.connect("changed", self.on_entry_target_size_changed)
+        hbox_target_size.add(entry_target_size)
+
+        label_target_size_unit = Gtk.Label("KB", xalign=0)
+        label_target_size_unit.set_margin_left(5)
+        hbox_target_size.add(label_target_size_unit)
+
+        vbox.add(hbox_target_size)
+
         vbox.show_all()
         self.popover.add(vbox)
         self.popover.set_position(Gtk.PositionType.BOTTOM)
@@ -291,6 +463,8 @@ class Window(Gtk.ApplicationWindow):
 
         dialog.set_select_multiple(True)
 
+        from patoolib import ArchiveMimetypes
+
         # filters
         filter_archive = Gtk.FileFilter()
         filter_archive.set_name("Archives")
@@ -320,12 +494,15 @@ class Window(Gtk.ApplicationWindow):
 
         response = dialog.run()
         if response == Gtk.ResponseType.ACCEPT:
+            from patoolib import ArchiveFormats
+
+            extentions = ArchiveFormats + ("cbz", "cbr")
             files_path = []
             folders_path = dialog.get_filenames()
             for folder_path in folders_path:
                 path = Path(folder_path)
                 if path.is_dir():
-                    for ext in self.extentions:
+                    for ext in extentions:
                         path_glob = str(path.joinpath(glob.escape(str(path)), "**/*." +
                                                       "".join("[%s%s]" % (e.lower(), e.upper()) for e in ext)))
                         files_path += glob.glob(path_glob, recursive=True)
@@ -351,7 +528,12 @@ class Window(Gtk.ApplicationWindow):
             action(Gio.SimpleAction): an action
             param(None): None
         """
-        if (self.thread_run is not None and self.thread_run.is_alive() and not self.event_run.is_set()):
+        if self.thread_dry_run is not None and self.thread_dry_run.is_alive():
+            # the run button stops the estimate
+            if not self.event_dry_run.is_set():
+                self.status_bar.push(0, "Estimate stop request...")
+                self.event_dry_run.set()
+        elif (self.thread_run is not None and self.thread_run.is_alive() and not self.event_run.is_set()):
             self.button_run.set_sensitive(False)
             self.button_run.set_label("Conversion stop request...")
             self.status_bar.push(0, "Conversion stop request...")
@@ -359,12 +541,70 @@ class Window(Gtk.ApplicationWindow):
         else:
             files_to_convert = self.drop_area.get_files_to_convert()
             if files_to_convert:
+                # the conversion stack (Pillow, patool) is loaded on the first run only
+                from converter import Converter
+
                 self.treatment_in_progress()
-                converter = Converter(files_to_convert, self.event_run, self.processing_completed)
+                converter = Converter(files_to_convert, self.event_run, self.processing_completed, self.on_progress)
                 self.thread_run = threading.Thread(target=converter.run)
                 self.thread_run.daemon = True
                 self.thread_run.start()
 
+    def on_dry_run(self, action: Gio.SimpleAction, param: None):
+        """Estimate the output size and the conversion time from a sample of the pages.
+
+        Args:
+            action(Gio.SimpleAction): an action
+            param(None): None
+        """
+        if self.thread_dry_run is not None and self.thread_dry_run.is_alive():
+            return
+
+        files_path = [file["file_path"] for file in self.drop_area.get_files_to_convert()]
+        if files_path:
+            from planner import Planner
+
+            fraction = int(self.preferences.get_value("dry_run_sample") or self.preferences.DEFAULT_DRY_RUN_SAMPLE) / 100
+            self.event_dry_run = threading.Event()
+            planner = Planner(files_path, fraction, self.event_dry_run)
+            self.button_dry_run.set_sensitive(False)
+            self.button_run.set_tooltip_text("Stop the estimate")
+            self.button_run.set_icon_widget(Gtk.Image.new_from_icon_name("process-stop-symbolic", self.icon_size))
+            self.button_run.show_all()
+            self.status_bar.push(0, "Estimating...")
+            self.thread_dry_run = threading.Thread(target=self.dry_run, args=(planner,))
+            self.thread_dry_run.daemon = True
+            self.thread_dry_run.start()
+
+    def dry_run(self, planner):
+        """Run the planner, in a thread.
+
+        Args:
+            planner (Planner): a planner
+        """
+        GLib.idle_add(self.dry_run_completed, planner.get_report(planner.plan()))
+
+    def dry_run_completed(self, report: str):
+        """Show the estimate of the output size and the conversion time.
+
+        Args:
+            report (str): a line per archive and a line for the total
+        """
+        self.button_dry_run.set_sensitive(True)
+        self.button_run.set_tooltip_text("Start conversion")
+        self.button_run.set_icon_widget(Gtk.Image.new_from_icon_name("system-run-symbolic", self.icon_size))
+        self.button_run.show_all()
+        if self.event_dry_run.is_set():
+            self.status_bar.push(0, "Estimate stopped")
+            return
+        self.status_bar.push(0, "Estimate complete")
+
+        dialog = Gtk.MessageDialog(transient_for=self, flags=Gtk.DialogFlags.MODAL, type=Gtk.MessageType.INFO,
+                                   buttons=Gtk.ButtonsType.CLOSE, message_format="Estimated output")
+        dialog.format_secondary_text(report)
+        dialog.run()
+        dialog.destroy()
+
     def processing_completed(self, manual: bool = False):
         """Conversion processing completed."""
         # self.event_run.clear()
@@ -376,11 +616,23 @@ class Window(Gtk.ApplicationWindow):
         self.button_add_folders.set_sensitive(True)
         self.button_remove_all.set_sensitive(True)
         self.button_preference.set_sensitive(True)
+        self.button_dry_run.set_sensitive(True)
         self.drop_area.set_sensitive(True)
         self.button_run.set_icon_widget(Gtk.Image.new_from_icon_name("system-run-symbolic", self.icon_size))
         self.status_bar.push(0, "Conversion complete")
         self.show_all()
 
+    def on_progress(self, text: str):
+        """Show the progress of the conversion.
+
+        Args:
+            text (str): the percent complete, the throughput and the estimated remaining time
+        """
+        if not self.event_run.is_set():
+            # replace the previous progress text instead of stacking the messages
+            self.status_bar.remove_all(0)
+            self.status_bar.push(0, text)
+
     def treatment_in_progress(self):
         """Update the UI for the current conversion process."""
         self.status_bar.push(0, "Converting...")
@@ -389,6 +641,7 @@ class Window(Gtk.ApplicationWindow):
         self.button_add_folders.set_sensitive(False)
         self.button_remove_all.set_sensitive(False)
         self.button_preference.set_sensitive(False)
+        self.button_dry_run.set_sensitive(False)
         self.drop_area.set_sensitive(False)
         self.button_run.set_icon_widget(Gtk.Image.new_from_icon_name(
             "process-stop-symbolic", self.icon_size))
@@ -401,6 +654,8 @@ class Window(Gtk.ApplicationWindow):
             action(Gio.SimpleAction): an action
             param(None): None
         """
+        if self.popover is None:
+            self.create_popover_preferences()
         self.popover.popup()
 
     def on_button_output_folder_toggled(self, button: Gtk.RadioButton, value: str):
@@ -429,6 +684,118 @@ class Window(Gtk.ApplicationWindow):
 
         dialog.destroy()
 
+    def on_button_scratch_folder_toggled(self, button: Gtk.RadioButton, value: str):
+        """Set the scratch folder.
+
+        Args:
+            button (Gtk.RadioButton): a radio button
+            value (str): SYSTEM for the system temporary folder or SELECTED for selected folder
+        """
+        self.preferences.set_value("scratch_location", value)
+
+    def on_button_select_scratch_folder(self, button: Gtk.Button):
+        """On the click of the "select folder" button of the scratch folder, open the file chooser dialog.
+
+        Args:
+            button (Gtk.button): button clicked
+        """
+        dialog = Gtk.FileChooserDialog(title="Choose a scratch folder", parent=self, action=Gtk.FileChooserAction.SELECT_FOLDER)
+        dialog.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL, Gtk.STOCK_OPEN, Gtk.ResponseType.OK)
+
+        response = dialog.run()
+        if response == Gtk.ResponseType.OK:
+            folder_path = dialog.get_filename()
+            self.preferences.set_value("scratch_folder", folder_path)
+            self.radio_button_selected_scratch_folder.set_label("In the folder " + self.preferences.get_value("scratch_folder"))
+
+        dialog.destroy()
+
+    def on_entry_scratch_wait_changed(self, entry):
+        """Set how long to wait for free scratch space.
+
+        Args:
+            entry (Gtk.Entry): a entry
+        """
+        try:
+            value = int(entry.get_text().strip())
+            entry.set_text(str(value))
+            self.preferences.set_value("scratch_wait", str(value))
+
+        except ValueError:
+            entry.set_text(self.preferences.DEFAULT_SCRATCH_WAIT)
+
+    def on_entry_prefetch_size_changed(self, entry):
+        """Set how many megabytes of the next archives are read ahead.
+
+        Args:
+            entry (Gtk.Entry): a entry
+        """
+        try:
+            value = int(entry.get_text().strip())
+            entry.set_text(str(value))
+            self.preferences.set_value("prefetch_size", str(value))
+
+        except ValueError:
+            entry.set_text(self.preferences.DEFAULT_PREFETCH_SIZE)
+
+    def on_button_background_mode_toggled(self, button: Gtk.CheckButton):
+        """Set the background mode.
+
+        Args:
+            button (Gtk.CheckButton): a check button
+        """
+        self.preferences.set_value("background_mode", "true" if button.get_active() else "false")
+
+    def on_entry_max_workers_changed(self, entry):
+        """Set the maximum number of workers.
+
+        Args:
+            entry (Gtk.Entry): a entry
+        """
+        try:
+            value = int(entry.get_text().strip())
+            entry.set_text(str(value))
+            self.preferences.set_value("max_workers", str(value))
+
+        except ValueError:
+            entry.set_text("0")
+
+    def on_entry_cpu_cores_changed(self, entry):
+        """Set the cores the workers are pinned to.
+
+        Args:
+            entry (Gtk.Entry): a entry
+        """
+        self.preferences.set_value("cpu_cores", entry.get_text().strip())
+
+    def on_entry_max_memory_changed(self, entry):
+        """Set the memory cap of the workers.
+
+        Args:
+            entry (Gtk.Entry): a entry
+        """
+        try:
+            value = int(entry.get_text().strip())
+            entry.set_text(str(value))
+            self.preferences.set_value("max_memory", str(value))
+
+        except ValueError:
+            entry.set_text("0")
+
+    def on_entry_dry_run_sample_changed(self, entry):
+        """Set the percentage of pages sampled by the estimate.
+
+        Args:
+            entry (Gtk.Entry): a entry
+        """
+        try:
+            value = min(max(int(entry.get_text().strip()), 1), 100)
+            entry.set_text(str(value))
+            self.preferences.set_value("dry_run_sample", str(value))
+
+        except ValueError:
+            entry.set_text(self.preferences.DEFAULT_DRY_RUN_SAMPLE)
+
     def combo_archive_format_changed(self, combo: Gtk.ComboBox):
         """Select output archive format.
 
@@ -447,6 +814,29 @@ class Window(Gtk.ApplicationWindow):
         text = combo.get_active_text()
         self.preferences.set_value("image_format", text)
 
+    def combo_target_size_mode_changed(self, combo: Gtk.ComboBox):
+        """Select the output size target.
+
+        Args:
+            combo (Gtk.ComboBox): a combo box
+        """
+        self.preferences.set_value("target_size_mode", combo.get_active_id())
+
+    def on_entry_target_size_changed(self, entry):
+        """Set the target size.
+
+        Args:
+            entry (Gtk.Entry): a entry
+        """
+        try:
+            # at least 1 KB
+            value = max(int(entry.get_text().strip()), 1)
+            entry.set_text(str(value))
+            self.preferences.set_value("target_size", str(value))
+
+        except ValueError:
+            entry.set_text(self.preferences.DEFAULT_TARGET_SIZE)
+
     def on_button_image_size_toggled(self, button: Gtk.RadioButton, value: str):
         """Set the image size.
 